@@ -1,12 +1,22 @@
 import os
+import base64
 import subprocess
+import threading
+from collections import OrderedDict
 from flask import Flask, request, render_template, jsonify, redirect, url_for
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from read_json import read_all_json_results
+from read_json import read_stored_results, invalidate_cache
+from modules import storage
+from jobs import JobManager
+from scheduler import run_task_graph
+from dotenv import load_dotenv
 import json
 
+load_dotenv()
 app = Flask(__name__)
 
+# Background workers that run submitted scans outside of the request cycle
+job_manager = JobManager(max_workers=int(os.getenv("SCAN_WORKERS", "2")))
+
 # Define subdirectories for scan results
 subdirectories = [
     "directories",
@@ -29,6 +39,8 @@ def delete_data():
     delete_script_path = "delete.py"
     if os.path.exists(delete_script_path):
         subprocess.run(["python3", delete_script_path], check=True)
+        storage.clear_results()
+        invalidate_cache()
     return redirect(url_for("index"))  # Redirect back to the main dashboard
 
 
@@ -71,6 +83,7 @@ def process_hosts_results(hosts_data):
             formatted_data.append({
                 "Host": host,
                 "Status Code": details.get('status_code', 'N/A'),
+                "Latency (ms)": details.get('latency_ms') or "",
                 "Error": ""  # No error message for online hosts
             })
 
@@ -80,6 +93,7 @@ def process_hosts_results(hosts_data):
             formatted_data.append({
                 "Host": host,
                 "Status Code": "",  # No status code for offline hosts
+                "Latency (ms)": "",
                 "Error": details.get('error', 'N/A')
             })
 
@@ -88,6 +102,12 @@ def process_hosts_results(hosts_data):
 
 def process_nmap_results(nmap_results):
     formatted_data = []
+    # Results of several scanned targets come as a list of per-host scans
+    if isinstance(nmap_results, list):
+        for host_results in nmap_results:
+            formatted_data.extend(process_nmap_results(host_results))
+        return formatted_data
+
     # Check if 'nmap_results' is a dictionary and contains necessary data
     if isinstance(nmap_results, dict) and 'host' in nmap_results and 'open_ports' in nmap_results:
         host = nmap_results.get('host', 'Unknown')  # Fallback to 'Unknown' if no host key
@@ -141,7 +161,8 @@ def process_sqli_results(vulnerabilities_results):
                         "Payload": vuln_info.get('payload', 'N/A'),
                         "Server OS": vuln_info.get('server_os', 'N/A'),
                         "DBMS": vuln_info.get('dbms', 'N/A'),
-                        "DBMS Version": vuln_info.get('dbms_version', 'N/A')
+                        "DBMS Version": vuln_info.get('dbms_version', 'N/A'),
+                        "Tier": vuln_info.get('tier', 'N/A')
                     }
                     formatted_data.append(entry)
     return formatted_data
@@ -223,37 +244,21 @@ def process_techstack_results(techstack_results):
 
 
 
+# Normalization applied to each category before it is cached
+result_processors = {
+    "techstack": process_techstack_results,
+    "nmap": process_nmap_results,
+    "subdomains": process_subdomains_results,
+    "hosts": process_hosts_results,
+    "sqli": process_sqli_results,
+    "directories": process_directory_results,
+}
+
+
 def read_results():
-    raw_results = read_all_json_results(subdirectories)  # Get the raw results
-
-    techstack_results = raw_results["techstack"]
-    nmap_results = raw_results["nmap"]
-    subdomain_results = raw_results["subdomains"]
-    hosts_results = raw_results["hosts"]
-    sqli_results = raw_results["sqli"]
-    dir_results = raw_results["directories"]
-    # flatten the techstack results based on the headers in the headingMappings
-    #print("Techstack results:", techstack_results)
-
-    flattened_techstack_results = process_techstack_results(techstack_results)
-    flattened_nmap_results = process_nmap_results(nmap_results)
-    flattened_subdomains_results = process_subdomains_results(subdomain_results)
-    flattened_hosts_results = process_hosts_results(hosts_results)
-    flattened_sqli_results = process_sqli_results(sqli_results)
-    flattened_dir_results = process_directory_results(dir_results)
-    #print()
-    #print()
-    #print("Processed techstack results:", flattened_techstack_results)
-    #print("Proccessed Nmap results:", flattened_nmap_results)
-    #print("Proccessed Subdomains results:", flattened_subdomains_results)
-    #print()
-    raw_results["techstack"] = flattened_techstack_results
-    raw_results["nmap"] = flattened_nmap_results
-    raw_results["subdomains"] = flattened_subdomains_results
-    raw_results["hosts"] = flattened_hosts_results
-    raw_results["sqli"] = flattened_sqli_results
-    raw_results["directories"] = flattened_dir_results
-    
+    # Parsed and normalized tables are served from an in-process cache and
+    # only rebuilt for categories whose stored rows or JSON files changed
+    raw_results = read_stored_results(subdirectories, processors=result_processors)
 
     return raw_results
 
@@ -282,16 +287,31 @@ def read_results():
     return refined_results
 
 
+# The pipeline crawls and runs the LFI, XSS and SQLI tests itself, so running
+# it next to these phases would do the same work twice against the target
+PIPELINE_CONFLICTS = ("Phase 2", "Phase 4", "Phase 5", "Phase 6")
+
+
+def phase_conflict(phases):
+    # Returns why the selected phases cannot run together, or None
+    conflicting = [phase for phase in PIPELINE_CONFLICTS if phase in phases]
+    if "Pipeline" in phases and conflicting:
+        return f"The streaming pipeline cannot run together with {', '.join(conflicting)}"
+    return None
+
+
 # Function to run scans based on selected phases
-def run_scans(target_domain, phases):
+def run_scans(target_domain, phases, job=None, force_rescan=False):
     from modules.web import (
         find_subdomains,
         read_subdomains_and_run_ffuf,
         run_httpx,
+        resolve_subdomains,
         run_crawler,
         shodan_search,
         run_tech_stack_detection,
         run_xss,
+        run_pipeline,
         lfi_scan,
         sqli_scan,
     )
@@ -300,6 +320,10 @@ def run_scans(target_domain, phases):
 
     load_dotenv()
     SHODAN_API_TOKEN = os.getenv("SHODAN_API_TOKEN")
+    # Stream findings to append-only NDJSON files instead of one JSON dump
+    NDJSON = os.getenv("RESULTS_FORMAT", "json").lower() == "ndjson"
+    # Cancelling the job kills the sqlmap processes of the SQLI scans
+    cancel = job.cancelled if job is not None else None
 
     # Define task phases
     Phase_1 = [
@@ -315,7 +339,9 @@ def run_scans(target_domain, phases):
         ),
     ]
     Phase_2 = [
-        ("Run HTTPx", run_httpx, ("results/subdomains",)),
+        # Only names that resolve (and are not wildcard matches) get probed
+        ("Resolve Subdomains", resolve_subdomains, ("results/subdomains", "results/dns", None, target_domain)),
+        ("Run HTTPx", run_httpx, ("results/dns", "results/hosts", NDJSON)),
         ("katana", run_crawler, (target_domain,)),
     ]
     Phase_3 = [
@@ -327,23 +353,78 @@ def run_scans(target_domain, phases):
                 "/mnt/d/flask-thesis/results/hosts",
                 "/mnt/d/flask-thesis/test/test.txt",
                 "/mnt/d/flask-thesis/results/directories",
+                NDJSON,
+                int(os.getenv("FFUF_WORKERS", "4")),
+                int(os.getenv("FFUF_MAX_RATE", "200")),
             ),
         ),
         (
             "Run Tech Stack Detection",
             run_tech_stack_detection,
-            ("results/hosts", "results/techstack"),
+            ("results/hosts", "results/techstack", int(os.getenv("TECHSTACK_WORKERS", "8"))),
         ),
     ]
     Phase_4 = [
         (
             "Run LFI Scan",
             lfi_scan,
-            ("results/katana", "results/lfi", "/opt/smalllfi.txt"),
+            (
+                "results/katana",
+                "results/lfi",
+                "/opt/smalllfi.txt",
+                NDJSON,
+                os.getenv("LFI_MODE", "batch"),
+                int(os.getenv("LFI_WORKERS", "4")),
+                int(os.getenv("LFI_TIME_BUDGET", "600")),
+                os.getenv("LFI_ENGINE", "ffuf"),
+                force_rescan,
+            ),
+        ),
+    ]
+    xss_precheck = os.getenv("XSS_PRECHECK", "true").lower() != "false"
+    Phase_5 = [("Run XSS Scan", run_xss, (NDJSON, force_rescan, int(os.getenv("XSS_WORKERS", "4")), xss_precheck))]
+    Phase_6 = [
+        (
+            "Run SQLI Scan",
+            sqli_scan,
+            (
+                target_domain,
+                NDJSON,
+                # 0 picks a worker count from the number of cores
+                int(os.getenv("SQLMAP_WORKERS", "0")) or None,
+                # 0: no cap beyond SQLMAP_WORKERS
+                int(os.getenv("SQLMAP_PER_HOST", "0")) or None,
+                os.getenv("SQLMAP_TIERED", "true").lower() != "false",
+                os.getenv("SQLMAP_RAW_LOGS", "false").lower() == "true",
+                force_rescan,
+                cancel,
+            ),
+        ),
+    ]
+
+    # Crawl and injection tests streamed into each other, instead of the
+    # crawler of Phase 2 and Phases 4 to 6
+    Phase_Pipeline = [
+        (
+            "Run Streaming Pipeline",
+            run_pipeline,
+            (
+                target_domain,
+                "/opt/smalllfi.txt",
+                force_rescan,
+                os.getenv("LFI_ENGINE", "ffuf"),
+                os.getenv("LFI_MODE", "batch"),
+                int(os.getenv("LFI_WORKERS", "4")),
+                int(os.getenv("LFI_TIME_BUDGET", "600")),
+                int(os.getenv("SQLMAP_WORKERS", "0")) or None,
+                os.getenv("SQLMAP_TIERED", "true").lower() != "false",
+                int(os.getenv("XSS_WORKERS", "4")),
+                xss_precheck,
+                int(os.getenv("SQLMAP_PER_HOST", "0")) or None,
+                cancel,
+            ),
         ),
     ]
-    Phase_5 = [("Run XSS Scan", run_xss, ())]
-    Phase_6 = [("Run SQLI Scan", sqli_scan, (target_domain,))]
 
     # Dictionary of phases
     phases_dict = {
@@ -353,40 +434,29 @@ def run_scans(target_domain, phases):
         "Phase 4": Phase_4,
         "Phase 5": Phase_5,
         "Phase 6": Phase_6,
+        "Pipeline": Phase_Pipeline,
     }
 
-    # Execute selected phases
-    for phase in phases:
-        execute_tasks(phases_dict[phase])
-
-
-def execute_tasks(tasks):
-    # Ensure 'tasks' is a list of tuples
-    if not isinstance(tasks, list):
-        raise TypeError("Expected a list of tasks")
+    conflict = phase_conflict(phases)
+    if conflict:
+        raise ValueError(conflict)
 
-    with ThreadPoolExecutor() as executor:
-        # Create a dictionary of futures to task names
-        futures_to_task = {
-            executor.submit(task[1], *task[2]): task[0] for task in tasks
-        }
-
-        for future in as_completed(futures_to_task):
-            task_name = futures_to_task[future]
-            try:
-                # Process each task and handle exceptions
-                future.result()
-            except Exception as exc:
-                print(f"Task '{task_name}' generated an exception: {exc}")
+    # Run the selected phases as one dependency graph: every task starts as
+    # soon as the artifacts it requires are produced, not when the previous
+    # phase has fully finished
+    tasks = []
+    for phase in phases:
+        tasks.extend(phases_dict[phase])
+    run_task_graph(tasks, job=job)
 
 
 headingMappings = {
     "directories" : ["URL , status , FUZZ"],
-    "hosts": ["Domain", "Status Code"],
-    "lfi": ["URL", "Status Code", "Payload"],
+    "hosts": ["Domain", "Status Code", "Latency (ms)"],
+    "lfi": ["URL", "Status Code", "Payload", "Length", "Words", "Lines", "Duration (ms)", "Suspected False Positive"],
     "nmap": ["Host", "Open Ports", "Protocol", "Service"],
     "shodan": ["IP Address", "Port", "Organization", "Operating System"],
-    "sqli": ["URL", "Payload"],
+    "sqli": ["URL", "Payload", "Server OS", "DBMS", "DBMS Version", "Tier"],
     "techstack": [
         "Host",
         "Operating System",
@@ -406,31 +476,169 @@ headingMappings = {
 # Route for the main dashboard
 @app.route("/", methods=["GET", "POST"])
 def index():
-    scan_results = read_results()  # Get content from all subdirectories
+    job = None
+    error = None
     if request.method == "POST":
         target_domain = request.form["target_domain"]
         selected_phases = request.form.getlist("phases")
+        force_rescan = request.form.get("force_rescan") == "on"
+        error = phase_conflict(selected_phases)
 
-        # Execute tasks based on selected phases
-        if selected_phases:
-            run_scans(target_domain, selected_phases)
+        # Queue the selected phases as a background job and return right away
+        if selected_phases and not error:
+            job = job_manager.submit(run_scans, target_domain, selected_phases, force_rescan=force_rescan)
 
-        # Refresh results after executing scans
-        scan_results = read_results()
+    # Result tables are fetched per tab from /api/results/<category>
+    return render_template(
+        "index.html",
+        categories=subdirectories,
+        headings=headingMappings,
+        job_id=job.id if job else None,
+        error=error,
+    )
 
-    print("Scan results:", scan_results)
 
-    for key, content_list in scan_results.items():
-        if content_list and isinstance(content_list[0], dict):
-            scan_results[key] = content_list
-        else:
-            scan_results[key] = []
+# Sorted/filtered views of the cached result tables, most recently used last
+_result_views = OrderedDict()
+_result_views_lock = threading.Lock()
+MAX_RESULT_VIEWS = 32
+
+
+def encode_cursor(offset):
+    return base64.urlsafe_b64encode(str(offset).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return max(int(base64.urlsafe_b64decode(cursor.encode()).decode()), 0)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def sort_key(value):
+    # Numbers sort numerically and before text, text sorts case-insensitively
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (0, value, "")
+    return (1, 0, str(value).lower())
+
+
+def get_result_view(category, rows, sort, order, filters, query):
+    key = (category, sort, order, filters, query)
+    with _result_views_lock:
+        cached = _result_views.get(key)
+        if cached is not None and cached[0] is rows:
+            _result_views.move_to_end(key)
+            return cached[1]
+
+    view = rows
+    for column, needle in filters:
+        needle = needle.lower()
+        view = [row for row in view if needle in str(row.get(column, "")).lower()]
+    if query:
+        query = query.lower()
+        view = [
+            row for row in view
+            if any(query in str(value).lower() for value in row.values())
+        ]
+    if sort:
+        view = sorted(view, key=lambda row: sort_key(row.get(sort, "")), reverse=order == "desc")
+
+    with _result_views_lock:
+        # Keep a reference to the source rows so a refreshed table never
+        # matches a stale view
+        _result_views[key] = (rows, view)
+        _result_views.move_to_end(key)
+        while len(_result_views) > MAX_RESULT_VIEWS:
+            _result_views.popitem(last=False)
+    return view
+
+
+# Route to page through one result category
+@app.route("/api/results/<category>", methods=["GET"])
+def api_results(category):
+    if category not in subdirectories:
+        return jsonify(error=f"Unknown category {category}"), 404
+
+    rows = read_stored_results([category], processors=result_processors)[category]
+    if not (isinstance(rows, list) and rows and isinstance(rows[0], dict)):
+        rows = []
+
+    try:
+        limit = min(max(int(request.args.get("limit", 100)), 1), 1000)
+        offset = decode_cursor(request.args["cursor"]) if request.args.get("cursor") else 0
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    sort = request.args.get("sort")
+    order = request.args.get("order", "asc")
+    query = request.args.get("q", "")
+    # Column filters are passed as ?filter=<column>:<substring>
+    filters = tuple(
+        tuple(f.split(":", 1)) for f in request.args.getlist("filter") if ":" in f
+    )
 
-    return render_template(
-        "index.html", scan_results=scan_results, headings=headingMappings
+    view = get_result_view(category, rows, sort, order, filters, query)
+    page = view[offset:offset + limit]
+    next_offset = offset + limit
+
+    return jsonify(
+        category=category,
+        columns=list(rows[0].keys()) if rows else [],
+        rows=page,
+        total=len(view),
+        next_cursor=encode_cursor(next_offset) if next_offset < len(view) else None,
     )
 
 
+# Route to submit a scan job without rendering the dashboard
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    data = request.get_json(silent=True) or request.form
+    target_domain = data.get("target_domain")
+    if hasattr(data, "getlist"):
+        selected_phases = data.getlist("phases")
+        force_rescan = data.get("force_rescan") == "on"
+    else:
+        selected_phases = data.get("phases", [])
+        force_rescan = bool(data.get("force_rescan", False))
+
+    if not target_domain or not selected_phases:
+        return jsonify(error="target_domain and phases are required"), 400
+    conflict = phase_conflict(selected_phases)
+    if conflict:
+        return jsonify(error=conflict), 400
+
+    job = job_manager.submit(run_scans, target_domain, selected_phases, force_rescan=force_rescan)
+    return jsonify(job_id=job.id, status=job.status), 202
+
+
+# Route to stop a queued or running scan job
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify(error=f"Job {job_id} not found"), 404
+    if job.finished_at is not None:
+        return jsonify(error=f"Job {job_id} already finished"), 409
+    job_manager.cancel(job_id)
+    return jsonify(job_id=job.id, status=job.status), 202
+
+
+# Route to list all scan jobs
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    return jsonify(jobs=[job.to_dict() for job in job_manager.list()])
+
+
+# Route to get the status, per-task state and duration of a scan job
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify(error=f"Job {job_id} not found"), 404
+    return jsonify(job.to_dict())
+
+
 # Route to list JSON files
 @app.route("/json-files", methods=["GET"])
 def list_json_files():
@@ -0,0 +1,132 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    def __init__(self, target_domain, phases, options=None):
+        self.id = uuid.uuid4().hex
+        self.target_domain = target_domain
+        self.phases = list(phases)
+        self.options = dict(options or {})
+        self.status = "queued"
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.tasks = {}
+        self.critical_path = None
+        # Set by JobManager.cancel; running scans watch it to stop early
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def task_started(self, task_name):
+        with self._lock:
+            self.tasks[task_name] = {
+                "status": "running",
+                "started_at": time.time(),
+                "finished_at": None,
+                "duration": None,
+                "error": None,
+            }
+
+    def task_finished(self, task_name, error=None):
+        with self._lock:
+            task = self.tasks.setdefault(task_name, {"started_at": time.time()})
+            task["finished_at"] = time.time()
+            task["duration"] = round(task["finished_at"] - task["started_at"], 3)
+            task["status"] = "failed" if error else "done"
+            task["error"] = str(error) if error else None
+
+    def task_cancelled(self, task_name):
+        # For tasks the cancellation kept from ever starting
+        with self._lock:
+            self.tasks[task_name] = {
+                "status": "cancelled",
+                "started_at": None,
+                "finished_at": None,
+                "duration": None,
+                "error": None,
+            }
+
+    def to_dict(self):
+        with self._lock:
+            duration = None
+            if self.started_at:
+                duration = round((self.finished_at or time.time()) - self.started_at, 3)
+            return {
+                "id": self.id,
+                "target_domain": self.target_domain,
+                "phases": self.phases,
+                "options": self.options,
+                "status": self.status,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "duration": duration,
+                "tasks": {name: dict(task) for name, task in self.tasks.items()},
+                "critical_path": self.critical_path,
+            }
+
+
+class JobManager:
+    """
+    Runs scan jobs on a pool of background workers so that the web tier
+    only has to enqueue a job and hand its id back to the client.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scan-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, runner, target_domain, phases, **options):
+        # options are passed on to the runner as keyword arguments
+        job = Job(target_domain, phases, options)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, runner)
+        return job
+
+    def _run(self, job, runner):
+        if job.cancelled.is_set():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            return
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            runner(job.target_domain, job.phases, job=job, **job.options)
+            failed = any(task.get("status") == "failed" for task in job.tasks.values())
+            if job.cancelled.is_set():
+                job.status = "cancelled"
+            else:
+                job.status = "failed" if failed else "done"
+        except Exception as e:
+            print(f"Job '{job.id}' generated an exception: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+
+    def cancel(self, job_id):
+        """
+        Asks a job to stop: a queued job never starts, a running one
+        schedules no further tasks and kills its sqlmap processes. Returns
+        the job, or None when there is no such job.
+        """
+        job = self.get(job_id)
+        if job is not None:
+            job.cancelled.set()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
@@ -0,0 +1,47 @@
+import os
+import json
+
+
+def ndjson_path(path):
+    # results/lfi/lfi_results.json -> results/lfi/lfi_results.ndjson
+    return os.path.splitext(path)[0] + ".ndjson"
+
+
+class NdjsonWriter:
+    """
+    Writes one JSON document per line and flushes after every record, so a
+    finding is on disk as soon as it is produced and a crash loses nothing.
+    """
+
+    def __init__(self, path, append=False):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.count = 0
+        self._file = open(path, "a" if append else "w")
+
+    def write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_ndjson(path):
+    # Yields records one at a time; a torn last line from a crashed writer is skipped
+    with open(path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping malformed line in {path}")
@@ -3,7 +3,10 @@ import sys
 import os
 import json
 import xmltodict
+from ..tasks import task
+from .. import storage
 
+@task(provides=("ports",))
 def scan_common_ports(target):
     nm = nmap.PortScanner()  # Initialize the PortScanner
     results_dir = "results/nmap"
@@ -54,6 +57,8 @@ def scan_common_ports(target):
         # Save the refined JSON result
         with open(json_output_path, 'w') as json_file:
             json.dump(refined_result, json_file, indent=4)
+
+        storage.save_ports(target, refined_result['open_ports'])
         
         print(f"Nmap Scan was done succesfully, results saved in JSON format at {json_output_path}")
                     
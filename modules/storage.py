@@ -0,0 +1,462 @@
+import os
+import gzip
+import hashlib
+import json
+import time
+import sqlite3
+import threading
+
+# Single results database shared by the scanners and the dashboard
+DEFAULT_DB_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "results", "scan_results.db"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hosts (
+    host TEXT PRIMARY KEY,
+    status_code INTEGER,
+    error TEXT,
+    latency_ms REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_hosts_status ON hosts (status_code);
+
+CREATE TABLE IF NOT EXISTS ports (
+    host TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    protocol TEXT NOT NULL,
+    service TEXT,
+    updated_at REAL,
+    PRIMARY KEY (host, port, protocol)
+);
+
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    host TEXT,
+    source TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_urls_host ON urls (host);
+
+CREATE TABLE IF NOT EXISTS directories (
+    url TEXT PRIMARY KEY,
+    host TEXT,
+    status INTEGER,
+    redirect_location TEXT,
+    fuzz TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_directories_host ON directories (host);
+CREATE INDEX IF NOT EXISTS idx_directories_status ON directories (status);
+
+CREATE TABLE IF NOT EXISTS findings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    category TEXT NOT NULL,
+    host TEXT,
+    url TEXT,
+    payload TEXT,
+    details TEXT,
+    updated_at REAL,
+    UNIQUE (category, url, payload)
+);
+CREATE INDEX IF NOT EXISTS idx_findings_category ON findings (category);
+CREATE INDEX IF NOT EXISTS idx_findings_host ON findings (host);
+CREATE INDEX IF NOT EXISTS idx_findings_url ON findings (url);
+
+CREATE TABLE IF NOT EXISTS tested_points (
+    signature TEXT NOT NULL,
+    scanner TEXT NOT NULL,
+    settings_hash TEXT NOT NULL,
+    tested_at REAL NOT NULL,
+    PRIMARY KEY (signature, scanner, settings_hash)
+);
+CREATE INDEX IF NOT EXISTS idx_tested_points_tested_at ON tested_points (tested_at);
+
+CREATE TABLE IF NOT EXISTS responses (
+    host TEXT PRIMARY KEY,
+    url TEXT,
+    status_code INTEGER,
+    headers TEXT,
+    body BLOB,
+    response_hash TEXT,
+    fetched_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS techstack_cache (
+    host TEXT PRIMARY KEY,
+    response_hash TEXT NOT NULL,
+    stack TEXT NOT NULL,
+    detected_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS revisions (
+    category TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL
+);
+"""
+
+# Columns added after a table was first released: (table, column, type)
+MIGRATIONS = [
+    ("hosts", "latency_ms", "REAL"),
+]
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_initialized = set()
+
+
+def get_db_path():
+    return os.getenv("RESULTS_DB") or DEFAULT_DB_PATH
+
+
+def get_connection():
+    """
+    Returns this thread's connection to the results database. WAL mode lets
+    the dashboard read while several scanner threads are writing.
+    """
+    db_path = get_db_path()
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    if db_path in connections:
+        return connections[db_path]
+
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    connection = sqlite3.connect(db_path, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    with _schema_lock:
+        if db_path not in _initialized:
+            connection.executescript(SCHEMA)
+            migrate(connection)
+            _initialized.add(db_path)
+    connections[db_path] = connection
+    return connection
+
+
+def migrate(connection):
+    for table, column, column_type in MIGRATIONS:
+        columns = {row["name"] for row in connection.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+    connection.commit()
+
+
+def host_of(url):
+    return url.split("://", 1)[-1].split("/", 1)[0].split("?", 1)[0]
+
+
+def _bump_revisions(connection, categories):
+    for category in categories:
+        connection.execute(
+            "INSERT INTO revisions (category, revision) VALUES (?, 1) "
+            "ON CONFLICT (category) DO UPDATE SET revision = revision + 1",
+            (category,),
+        )
+
+
+def add_subdomains(subdomains):
+    connection = get_connection()
+    with connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO hosts (host, updated_at) VALUES (?, ?)",
+            [(subdomain, time.time()) for subdomain in subdomains],
+        )
+        _bump_revisions(connection, ("subdomains",))
+
+
+def save_hosts(hosts):
+    # hosts: iterable of {"host", "status_code", "latency_ms"} or {"host", "error"}
+    connection = get_connection()
+    with connection:
+        connection.executemany(
+            "INSERT INTO hosts (host, status_code, error, latency_ms, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (host) DO UPDATE SET status_code = excluded.status_code, "
+            "error = excluded.error, latency_ms = excluded.latency_ms, updated_at = excluded.updated_at",
+            [
+                (h["host"], h.get("status_code"), h.get("error"), h.get("latency_ms"), time.time())
+                for h in hosts
+            ],
+        )
+        _bump_revisions(connection, ("hosts", "subdomains"))
+
+
+def save_ports(host, open_ports):
+    connection = get_connection()
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO ports (host, port, protocol, service, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (host, int(p["port"]), p["protocol"], p.get("service"), time.time())
+                for p in open_ports
+            ],
+        )
+        _bump_revisions(connection, ("nmap",))
+
+
+def save_urls(urls, source):
+    connection = get_connection()
+    with connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO urls (url, host, source, updated_at) VALUES (?, ?, ?, ?)",
+            ((url, host_of(url), source, time.time()) for url in urls),
+        )
+        _bump_revisions(connection, ("katana",))
+
+
+def save_directories(entries):
+    # entries: iterable of ffuf results reformatted by reformat_results
+    connection = get_connection()
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO directories "
+            "(url, host, status, redirect_location, fuzz, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    e["url"],
+                    host_of(e["url"]),
+                    e.get("status"),
+                    e.get("redirectlocation"),
+                    e.get("FUZZ"),
+                    time.time(),
+                )
+                for e in entries
+            ],
+        )
+        _bump_revisions(connection, ("directories",))
+
+
+# Categories whose host-only findings replace each other: one row per host
+SINGLE_FINDING_PER_HOST = {"techstack"}
+
+
+def finding_key(category, finding):
+    """
+    Value of the payload column, which with (category, url) is the unique
+    key. Host-only findings (no url, no payload), like several Shodan
+    results for one IP, are told apart by a digest of their contents.
+    """
+    if finding.get("payload") or finding.get("url") or category in SINGLE_FINDING_PER_HOST:
+        return finding.get("payload") or ""
+    return "#" + hashlib.sha1(json.dumps(finding, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def save_findings(category, findings):
+    # findings: iterable of dicts with a "url", "host" or "ip" key; the whole
+    # dict is kept as details so every scanner keeps its own fields
+    connection = get_connection()
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO findings (category, host, url, payload, details, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    category,
+                    host,
+                    f.get("url") or host,
+                    finding_key(category, f),
+                    json.dumps(f),
+                    time.time(),
+                )
+                for f in findings
+                for host in (f.get("host") or f.get("ip") or host_of(f.get("url", "")),)
+            ],
+        )
+        _bump_revisions(connection, (category,))
+
+
+def mark_tested(scanner, settings_hash, signatures):
+    connection = get_connection()
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO tested_points (signature, scanner, settings_hash, tested_at) "
+            "VALUES (?, ?, ?, ?)",
+            [(signature, scanner, settings_hash, time.time()) for signature in signatures],
+        )
+
+
+def get_tested(scanner, settings_hash, max_age):
+    # Signatures this scanner tested with these settings within max_age seconds
+    connection = get_connection()
+    return {
+        row["signature"]
+        for row in connection.execute(
+            "SELECT signature FROM tested_points WHERE scanner = ? AND settings_hash = ? AND tested_at >= ?",
+            (scanner, settings_hash, time.time() - max_age),
+        )
+    }
+
+
+def evict_tested(max_age):
+    connection = get_connection()
+    with connection:
+        cursor = connection.execute(
+            "DELETE FROM tested_points WHERE tested_at < ?", (time.time() - max_age,)
+        )
+    return cursor.rowcount
+
+
+def save_responses(responses):
+    # responses: iterable of {"host", "url", "status_code", "headers", "body", "response_hash"}
+    # as captured by the host prober; bodies are stored gzipped
+    connection = get_connection()
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO responses "
+            "(host, url, status_code, headers, body, response_hash, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    r["host"],
+                    r["url"],
+                    r["status_code"],
+                    json.dumps(r["headers"]),
+                    gzip.compress(r["body"]),
+                    r["response_hash"],
+                    time.time(),
+                )
+                for r in responses
+            ],
+        )
+
+
+def get_response(host):
+    connection = get_connection()
+    row = connection.execute("SELECT * FROM responses WHERE host = ?", (host,)).fetchone()
+    if row is None:
+        return None
+    return {
+        "host": row["host"],
+        "url": row["url"],
+        "status_code": row["status_code"],
+        "headers": json.loads(row["headers"]),
+        "body": gzip.decompress(row["body"]),
+        "response_hash": row["response_hash"],
+        "fetched_at": row["fetched_at"],
+    }
+
+
+def save_cached_stack(host, response_hash, stack):
+    connection = get_connection()
+    with connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO techstack_cache (host, response_hash, stack, detected_at) VALUES (?, ?, ?, ?)",
+            (host, response_hash, json.dumps(stack), time.time()),
+        )
+
+
+def get_cached_stack(host, response_hash, max_age):
+    # The stack detected for host within max_age seconds, if its response has not changed since
+    connection = get_connection()
+    row = connection.execute(
+        "SELECT stack FROM techstack_cache WHERE host = ? AND response_hash = ? AND detected_at >= ?",
+        (host, response_hash, time.time() - max_age),
+    ).fetchone()
+    return json.loads(row["stack"]) if row is not None else None
+
+
+def get_revisions():
+    connection = get_connection()
+    return {
+        row["category"]: row["revision"]
+        for row in connection.execute("SELECT category, revision FROM revisions")
+    }
+
+
+def get_online_hosts(status_codes=(200, 301)):
+    connection = get_connection()
+    placeholders = ", ".join("?" for _ in status_codes)
+    return [
+        row["host"]
+        for row in connection.execute(
+            f"SELECT host FROM hosts WHERE status_code IN ({placeholders}) ORDER BY host",
+            tuple(status_codes),
+        )
+    ]
+
+
+def iter_urls(host=None):
+    connection = get_connection()
+    if host is None:
+        rows = connection.execute("SELECT url FROM urls ORDER BY url")
+    else:
+        rows = connection.execute("SELECT url FROM urls WHERE host = ? ORDER BY url", (host,))
+    for row in rows:
+        yield row["url"]
+
+
+def read_category(category):
+    """
+    Returns the stored rows of a dashboard category in the same shape as the
+    JSON results it replaces, so the existing process_*_results functions
+    keep working on them.
+    """
+    connection = get_connection()
+
+    if category == "subdomains":
+        return [row["host"] for row in connection.execute("SELECT host FROM hosts ORDER BY host")]
+
+    if category == "hosts":
+        hosts = {"online": {}, "offline": {}}
+        for row in connection.execute(
+            "SELECT host, status_code, error, latency_ms FROM hosts "
+            "WHERE status_code IS NOT NULL OR error IS NOT NULL ORDER BY host"
+        ):
+            if row["status_code"] is not None:
+                hosts["online"][row["host"]] = {"status_code": row["status_code"], "latency_ms": row["latency_ms"]}
+            else:
+                hosts["offline"][row["host"]] = {"error": row["error"]}
+        return hosts
+
+    if category == "nmap":
+        scans = {}
+        for row in connection.execute("SELECT * FROM ports ORDER BY host, port"):
+            scans.setdefault(row["host"], {"host": row["host"], "open_ports": []})["open_ports"].append(
+                {"port": str(row["port"]), "protocol": row["protocol"], "service": row["service"]}
+            )
+        return list(scans.values())
+
+    if category == "directories":
+        directories = {}
+        for row in connection.execute("SELECT * FROM directories ORDER BY host, url"):
+            directories.setdefault(row["host"], []).append({
+                "url": row["url"],
+                "status": row["status"],
+                "redirectlocation": row["redirect_location"],
+                "FUZZ": row["fuzz"],
+            })
+        return directories
+
+    if category == "katana":
+        return [
+            {"URL": row["url"], "Source": row["source"]}
+            for row in connection.execute("SELECT url, source FROM urls ORDER BY url")
+        ]
+
+    rows = connection.execute(
+        "SELECT host, details FROM findings WHERE category = ? ORDER BY id", (category,)
+    )
+    if category == "techstack":
+        return {row["host"]: json.loads(row["details"])["stack"] for row in rows}
+    if category == "sqli":
+        # Group payloads back under their URL like sqli_results.json
+        grouped = {}
+        for row in rows:
+            details = json.loads(row["details"])
+            grouped.setdefault(details["url"], []).append(
+                {k: v for k, v in details.items() if k != "url"}
+            )
+        return [{"url": url, "vulnerabilities": vulns} for url, vulns in grouped.items()]
+    return [json.loads(row["details"]) for row in rows]
+
+
+def clear_results():
+    connection = get_connection()
+    with connection:
+        for table in (
+            "hosts", "ports", "urls", "directories", "findings", "tested_points", "responses", "techstack_cache",
+        ):
+            connection.execute(f"DELETE FROM {table}")
+        # Bump instead of dropping revisions so cached tables are never reused
+        connection.execute("UPDATE revisions SET revision = revision + 1")
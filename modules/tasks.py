@@ -0,0 +1,11 @@
+def task(requires=(), provides=()):
+    """
+    Declares which scan artifacts (subdomains, hosts, urls, ...) a task reads
+    and which ones it produces, so the scheduler can start it as soon as its
+    inputs are ready instead of waiting for a whole phase to finish.
+    """
+    def decorator(func):
+        func.requires = tuple(requires)
+        func.provides = tuple(provides)
+        return func
+    return decorator
@@ -2,12 +2,20 @@ from .sublist3r import *
 from .ffuf import *
 from .nuclei import *
 from .hosts import *
+from .resolver import *
 from .shodan import *
 from .nuclei import *
 from .stack import *
 from .screenshotter import *
 from .gospider import *
+from .corpus import *
+from .urlstream import *
 from .katana import *
+from .patterns import *
+from .dedup import *
+from .reflection import *
 from .xss import *
 from .lfi import *
-from .sqli import *
\ No newline at end of file
+from .lfi_async import *
+from .sqli import *
+from .pipeline import *
\ No newline at end of file
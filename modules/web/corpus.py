@@ -0,0 +1,151 @@
+import os
+import gzip
+import time
+import threading
+import subprocess
+
+# Historical URLs per domain, shared by every stage and every scan
+DEFAULT_CORPUS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "results", "corpus"
+)
+DEFAULT_TTL_HOURS = 24
+# "{domain}" is replaced by the target; point URL_CORPUS_COMMAND at a local
+# stand-in for gau to test without hitting the archives
+DEFAULT_FETCH_COMMAND = ["gau", "{domain}"]
+
+
+def run_fetch_command(command, domain):
+    # Streams the URLs a fetch command prints on stdout
+    process = subprocess.Popen(
+        [part.replace("{domain}", domain) for part in command],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        errors="replace",
+    )
+    try:
+        for line in process.stdout:
+            yield line
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+class UrlCorpus:
+    """
+    Fetches the historical URLs of a domain once, keeps them gzipped on disk
+    for `ttl` seconds and serves them to every stage that needs them. `fetch`
+    is a command template (see DEFAULT_FETCH_COMMAND) or a callable that
+    takes the domain and returns an iterable of URLs.
+    """
+
+    def __init__(self, corpus_dir=None, ttl=None, fetch=None):
+        self.corpus_dir = corpus_dir or os.getenv("URL_CORPUS_DIR") or DEFAULT_CORPUS_DIR
+        if ttl is None:
+            ttl = float(os.getenv("URL_CORPUS_TTL_HOURS", DEFAULT_TTL_HOURS)) * 3600
+        self.ttl = ttl
+        if fetch is None:
+            configured = os.getenv("URL_CORPUS_COMMAND")
+            fetch = configured.split() if configured else DEFAULT_FETCH_COMMAND
+        self.fetch = fetch
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def path(self, domain):
+        return os.path.join(self.corpus_dir, f"{domain.lower()}.txt.gz")
+
+    def is_fresh(self, domain):
+        path = self.path(domain)
+        return os.path.exists(path) and time.time() - os.path.getmtime(path) < self.ttl
+
+    def _lock(self, domain):
+        with self._locks_lock:
+            return self._locks.setdefault(domain.lower(), threading.Lock())
+
+    def _fetch(self, domain):
+        if callable(self.fetch):
+            return self.fetch(domain)
+        return run_fetch_command(self.fetch, domain)
+
+    def _fetch_and_store(self, domain, failed):
+        # Yields URLs as the fetch produces them while writing the new corpus
+        path = self.path(domain)
+        os.makedirs(self.corpus_dir, exist_ok=True)
+        temp_path = path + ".tmp"
+        count = 0
+        try:
+            with gzip.open(temp_path, "wt") as file:
+                for url in self._fetch(domain):
+                    url = url.strip()
+                    if url:
+                        file.write(url + "\n")
+                        count += 1
+                        yield url
+            os.replace(temp_path, path)
+            print(f"Fetched {count} historical URLs for {domain} into {path}")
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Fetching historical URLs for {domain} failed: {e}")
+            failed.append(e)
+        finally:
+            # Also reached when the consumer stops reading part way through
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def ensure(self, domain, refresh=False):
+        """
+        Returns the corpus file of domain, fetching it first when it is
+        missing, expired or refresh is set. Concurrent callers for the same
+        domain wait for a single fetch.
+        """
+        path = self.path(domain)
+        with self._lock(domain):
+            if refresh or not self.is_fresh(domain):
+                failed = []
+                for _ in self._fetch_and_store(domain, failed):
+                    pass
+                if failed:
+                    if not os.path.exists(path):
+                        # Serve an empty corpus but do not cache it
+                        return None
+                    print(f"Serving the previous corpus for {domain}")
+        return path
+
+    def iter_urls(self, domain, refresh=False):
+        """
+        Yields the corpus of domain. When it has to be fetched, URLs are
+        yielded as the fetch produces them instead of after it finished.
+        """
+        with self._lock(domain):
+            if refresh or not self.is_fresh(domain):
+                failed = []
+                yield from self._fetch_and_store(domain, failed)
+                if not failed:
+                    return
+        path = self.path(domain)
+        if not os.path.exists(path):
+            return
+        with gzip.open(path, "rt") as file:
+            for line in file:
+                yield line.rstrip("\n")
+
+    def export(self, domain, output_file, refresh=False):
+        # Plain text copy for the tools and stages that read URL files
+        with open(output_file, "w") as file:
+            for url in self.iter_urls(domain, refresh):
+                file.write(url + "\n")
+        return output_file
+
+
+_corpus = None
+_corpus_lock = threading.Lock()
+
+
+def get_corpus():
+    global _corpus
+    with _corpus_lock:
+        if _corpus is None:
+            _corpus = UrlCorpus()
+        return _corpus
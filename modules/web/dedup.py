@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl
+from .. import storage
+
+# How long a tested injection point is skipped by later runs, in hours
+DEFAULT_TESTED_TTL_HOURS = 168
+
+
+def injection_signature(url):
+    """
+    (scheme, host, path, sorted parameter names): URLs that only differ in
+    parameter values or parameter order expose the same injection points.
+    """
+    parts = urlsplit(url.strip())
+    names = sorted({name for name, _ in parse_qsl(parts.query, keep_blank_values=True)})
+    return (parts.scheme.lower(), parts.netloc.lower(), parts.path, tuple(names))
+
+
+# File types uro drops: nothing to inject into
+STATIC_EXTENSIONS = {
+    "css", "png", "jpg", "jpeg", "svg", "ico", "webp", "scss", "tif", "tiff", "ttf", "otf",
+    "woff", "woff2", "gif", "pdf", "bmp", "eot", "mp3", "mp4", "avi",
+}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+NUMERIC_SEGMENT = re.compile(r"^\d+$")
+
+
+class UrlCanonicalizer:
+    """
+    Streaming replacement for uro. Normalizes scheme and host case, default
+    ports and parameter order, drops static assets, and keeps one URL per
+    (host, path with numeric segments collapsed, parameter names). Only an
+    8-byte digest of every key is remembered.
+    """
+
+    def __init__(self):
+        self.seen = set()
+        self.stats = {"total": 0, "static": 0, "duplicate": 0, "unique": 0}
+
+    def canonicalize(self, url):
+        # Returns (normalized URL, dedup key), or None for unparsable URLs and static assets
+        try:
+            parts = urlsplit(url.strip())
+            port = parts.port
+        except ValueError:
+            return None
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or "").lower()
+        if not scheme or not host:
+            return None
+
+        path = parts.path or "/"
+        filename = path.rsplit("/", 1)[-1]
+        if "." in filename and filename.rpartition(".")[2].lower() in STATIC_EXTENSIONS:
+            return None
+
+        netloc = host if port in (None, DEFAULT_PORTS.get(scheme)) else f"{host}:{port}"
+        # Reorder the raw name=value pairs so values keep their original encoding
+        params = sorted((pair for pair in parts.query.split("&") if pair), key=lambda pair: pair.split("=", 1)[0])
+        normalized = urlunsplit((scheme, netloc, path, "&".join(params), ""))
+
+        collapsed = "/".join("{n}" if NUMERIC_SEGMENT.match(segment) else segment for segment in path.split("/"))
+        names = sorted({pair.split("=", 1)[0] for pair in params})
+        key = f"{scheme}://{netloc}{collapsed}?{'&'.join(names)}"
+        return normalized, key
+
+    def feed(self, url):
+        # Returns the normalized URL the first time its key is seen, else None
+        url = url.strip()
+        if not url:
+            return None
+        self.stats["total"] += 1
+        canonical = self.canonicalize(url)
+        if canonical is None:
+            self.stats["static"] += 1
+            return None
+        normalized, key = canonical
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        if digest in self.seen:
+            self.stats["duplicate"] += 1
+            return None
+        self.seen.add(digest)
+        self.stats["unique"] += 1
+        return normalized
+
+    def stream(self, urls):
+        for url in urls:
+            normalized = self.feed(url)
+            if normalized is not None:
+                yield normalized
+
+
+def canonical_urls(*sources):
+    # Yields the unique URLs of several URL iterables (or open files) in order
+    canonicalizer = UrlCanonicalizer()
+    for source in sources:
+        yield from canonicalizer.stream(source)
+
+
+def signature_key(url):
+    return json.dumps(injection_signature(url))
+
+
+def settings_hash(*settings):
+    # Stable digest of everything that changes what a scanner would test
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def file_digest(path):
+    with open(path, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()[:16]
+
+
+def dedupe_urls(urls, stats=None):
+    # Yields the first URL seen for every signature; stats gets the counts
+    seen = set()
+    if stats is None:
+        stats = {}
+    stats.update(total=0, unique=0)
+    for url in urls:
+        url = url.strip()
+        if not url:
+            continue
+        stats["total"] += 1
+        signature = injection_signature(url)
+        if signature in seen:
+            continue
+        seen.add(signature)
+        stats["unique"] += 1
+        yield url
+
+
+def dedupe_file(input_file, output_file=None):
+    """
+    Keeps one representative URL per injection signature, in place unless
+    output_file is given, and prints how much the list shrank.
+    """
+    output_file = output_file or input_file
+    stats = {}
+    temp_file = output_file + ".tmp"
+    with open(input_file, "r", errors="replace") as source, open(temp_file, "w") as target:
+        for url in dedupe_urls(source, stats):
+            target.write(url + "\n")
+    os.replace(temp_file, output_file)
+
+    if stats["total"]:
+        reduction = 1 - stats["unique"] / stats["total"]
+        print(
+            f"Deduplicated {input_file}: {stats['total']} -> {stats['unique']} URLs "
+            f"({reduction:.1%} fewer injection points to test)"
+        )
+    return stats
+
+
+def get_tested_ttl():
+    return float(os.getenv("TESTED_TTL_HOURS", DEFAULT_TESTED_TTL_HOURS)) * 3600
+
+
+def skip_tested(url_file, scanner, settings, force_rescan=False):
+    """
+    Drops the URLs whose injection signature this scanner already tested
+    with the same settings within TESTED_TTL_HOURS, rewriting url_file in
+    place. Expired entries are evicted on the way.
+    """
+    ttl = get_tested_ttl()
+    storage.evict_tested(ttl)
+    if force_rescan:
+        return 0
+
+    tested = storage.get_tested(scanner, settings, ttl)
+    if not tested:
+        return 0
+    kept = skipped = 0
+    temp_file = url_file + ".tmp"
+    with open(url_file, "r", errors="replace") as source, open(temp_file, "w") as target:
+        for url in source:
+            url = url.strip()
+            if not url:
+                continue
+            if signature_key(url) in tested:
+                skipped += 1
+                continue
+            target.write(url + "\n")
+            kept += 1
+    os.replace(temp_file, url_file)
+    print(f"Skipping {skipped} {scanner} injection points tested in the last {ttl / 3600:g}h, {kept} left")
+    return skipped
+
+
+def mark_tested(urls, scanner, settings):
+    storage.mark_tested(scanner, settings, {signature_key(url) for url in urls if url.strip()})
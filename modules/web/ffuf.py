@@ -1,9 +1,17 @@
 import subprocess
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ..tasks import task
+from .. import storage
+from ..ndjson import NdjsonWriter, iter_ndjson
 
 def load_online_subdomains(hosts_dir_path):
-    online_subdomains = []
+    # Prefer the probed hosts in the results database over the JSON files
+    online_subdomains = storage.get_online_hosts()
+    if online_subdomains:
+        return online_subdomains
+
     if not os.path.exists(hosts_dir_path):
         print(f"Directory not found: {hosts_dir_path}")
         return online_subdomains
@@ -22,20 +30,28 @@ def load_online_subdomains(hosts_dir_path):
                 print(f"Error decoding JSON from {filename}")
             except FileNotFoundError:
                 print(f"File not found: {filename}")
+        elif filename.endswith('.ndjson'):
+            for record in iter_ndjson(os.path.join(hosts_dir_path, filename)):
+                if record.get('status_code') in [200, 301]:
+                    online_subdomains.append(record['host'])
     return online_subdomains
 
-def run_ffuf(subdomain, wordlist, results_dir):
+def run_ffuf(subdomain, wordlist, results_dir, rate=0):
     result_file = os.path.join(results_dir, f'{subdomain.replace(":", "_").replace("/", "_")}_ffuf.json')
     os.makedirs(results_dir, exist_ok=True)
     
     command = ['ffuf', '-w', wordlist, '-u', f'http://{subdomain}/FUZZ', '-fc', '401,403,500','-r',
                '-o', result_file, '-of', 'json']
+    if rate:
+        # This process' share of the global requests-per-second budget
+        command += ['-rate', str(rate)]
     try:
         subprocess.run(command, capture_output=True, text=True, timeout=90)
     except subprocess.TimeoutExpired:
         print(f"ffuf timed out for {subdomain}")
     except subprocess.CalledProcessError as e:
         print(f"Error running ffuf for {subdomain}: {str(e)}")
+    return result_file
 
 def reformat_results(results):
     formatted_results = []
@@ -49,32 +65,75 @@ def reformat_results(results):
         formatted_results.append(formatted_result)
     return formatted_results
 
-def compile_ffuf_results(results_dir, target):
+def collect_ffuf_result(result_file):
+    # Parse one host's ffuf output and remove the per-host file
+    if not os.path.exists(result_file):
+        return []
+    try:
+        with open(result_file, 'r') as file:
+            data = json.load(file)
+    except json.JSONDecodeError:
+        print(f"Failed to decode JSON for {os.path.basename(result_file)}")
+        return []
+    finally:
+        os.remove(result_file)
+    return reformat_results(data.get('results', []))
+
+@task(requires=("hosts",), provides=("directories",))
+def read_subdomains_and_run_ffuf(target, hosts_dir_path, wordlist_path, results_dir, ndjson=False,
+                                 workers=4, max_rate=200):
+    """
+    Runs up to `workers` ffuf processes at once, splitting `max_rate`
+    requests per second between them. Each host's results are stored, and
+    streamed to NDJSON, as soon as its process finishes; the JSON output is
+    written once at the end.
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    online_subdomains = load_online_subdomains(hosts_dir_path)
+    if not online_subdomains:
+        print(f"No online hosts to run ffuf on for {target}")
+        return
+
+    workers = max(min(workers, len(online_subdomains)), 1)
+    rate = max(max_rate // workers, 1) if max_rate else 0
+
+    compiled_file_name = f"{target.replace(':', '_').replace('/', '_')}_ffuf_results"
+    compiled_file_path = os.path.join(results_dir, compiled_file_name + ('.ndjson' if ndjson else '.json'))
+    writer = NdjsonWriter(compiled_file_path) if ndjson else None
     compiled_results = {}
-    for filename in os.listdir(results_dir):
-        if filename.endswith('_ffuf.json'):
-            full_path = os.path.join(results_dir, filename)
-            subdomain = filename[:-10].replace("_", ":").replace("_", "/")
-            try:
-                with open(full_path, 'r') as file:
-                    data = json.load(file)
-                    if 'results' in data:
-                        compiled_results[subdomain] = reformat_results(data['results'])
-                os.remove(full_path)
-            except json.JSONDecodeError:
-                print(f"Failed to decode JSON for {filename}")
 
-    compiled_file_name = f"{target.replace(':', '_').replace('/', '_')}_ffuf_results.json"
-    compiled_file_path = os.path.join(results_dir, compiled_file_name)
-    with open(compiled_file_path, 'w') as file:
-        json.dump(compiled_results, file, indent=4)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(run_ffuf, subdomain, wordlist_path, results_dir, rate): subdomain
+                for subdomain in online_subdomains
+            }
+            for future in as_completed(futures):
+                subdomain = futures[future]
+                try:
+                    entries = collect_ffuf_result(future.result())
+                except Exception as e:
+                    print(f"Error running ffuf for {subdomain}: {e}")
+                    continue
 
-def read_subdomains_and_run_ffuf(target, hosts_dir_path, wordlist_path, results_dir):
-    online_subdomains = load_online_subdomains(hosts_dir_path)
-    for subdomain in online_subdomains:
-        run_ffuf(subdomain, wordlist_path, results_dir)
-    compile_ffuf_results(results_dir, target)
-    print(f"Compiled ffuf results for {target} saved to {results_dir}")
+                storage.save_directories(entries)
+                if writer is not None:
+                    for entry in entries:
+                        writer.write({'host': subdomain, **entry})
+                else:
+                    compiled_results[subdomain] = entries
+                print(f"ffuf finished for {subdomain}: {len(entries)} results")
+    finally:
+        if writer is not None:
+            writer.close()
+        else:
+            # Also keeps the hosts that finished when a later one fails
+            temp_path = compiled_file_path + '.tmp'
+            with open(temp_path, 'w') as file:
+                json.dump(compiled_results, file, indent=4)
+            os.replace(temp_path, compiled_file_path)
+
+    print(f"Compiled ffuf results for {target} saved to {compiled_file_path}")
 
 if __name__ == "__main__":
     target = "testphp.vulnweb.com"
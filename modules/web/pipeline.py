@@ -0,0 +1,279 @@
+import os
+import time
+import shutil
+import queue
+import threading
+from ..tasks import task
+from .. import storage
+from ..ndjson import NdjsonWriter
+from .katana import run_crawler
+from .urlstream import UrlStream
+from .patterns import get_engine
+from .dedup import signature_key, settings_hash, get_tested_ttl, mark_tested
+from .lfi import fuzz_url, fuzz_lfi_file, lfi_settings
+from .xss import run_xss_tools, XSS_SETTINGS
+from .reflection import prune_unreflected
+from .sqli import scan_url, sqlmap_run, save_parsed_entry, default_sqlmap_workers, SQLMAP_TIERS, FULL_SCAN
+
+_DONE = object()
+
+
+def iter_batches(source, batch_size, max_wait):
+    """
+    Groups the items of a queue into batches of up to batch_size, handing a
+    partial batch over once its first item has waited max_wait seconds. The
+    end marker is put back so the stage's drain sees it as well.
+    """
+    batch = []
+    deadline = None
+    while True:
+        timeout = None if not batch else max(deadline - time.monotonic(), 0)
+        try:
+            item = source.get(timeout=timeout)
+        except queue.Empty:
+            yield batch
+            batch = []
+            continue
+        if item is _DONE:
+            source.put(_DONE)
+            if batch:
+                yield batch
+            return
+        batch.append(item)
+        if len(batch) == 1:
+            deadline = time.monotonic() + max_wait
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+
+class ScanPipeline:
+    """
+    Crawler -> classifier -> LFI/XSS/SQLi scanners, connected by bounded
+    queues. A full queue blocks the stage in front of it all the way back to
+    the crawler, so memory stays flat and scanners start on the first URLs
+    while the crawl is still running.
+    """
+
+    def __init__(self, target_domain, payloads_file, work_dir="results/pipeline", queue_size=1000,
+                 force_rescan=False, lfi_engine="ffuf", lfi_mode="batch", lfi_workers=4, lfi_budget=600,
+                 sqlmap_workers=None, tiered=True, xss_workers=4, xss_precheck=True, sqlmap_per_host=None,
+                 cancel=None):
+        self.target_domain = target_domain
+        self.payloads_file = payloads_file
+        self.work_dir = os.path.abspath(work_dir)
+        self.queue_size = queue_size
+        self.force_rescan = force_rescan
+        self.lfi_engine = lfi_engine
+        self.lfi_mode = lfi_mode
+        self.lfi_workers = lfi_workers
+        self.lfi_budget = lfi_budget
+        self.sqlmap_workers = sqlmap_workers or default_sqlmap_workers()
+        # Same cap as run_sqlmap_on_all_urls: by default the whole pool may work on one host
+        self.sqlmap_per_host = sqlmap_per_host or self.sqlmap_workers
+        self.tiered = tiered
+        self.xss_workers = xss_workers
+        self.xss_precheck = xss_precheck
+        # Event that kills the running sqlmap processes when set
+        self.cancel = cancel
+
+        self.settings = {
+            "lfi": lfi_settings(payloads_file, lfi_mode, lfi_engine),
+            "xss": XSS_SETTINGS,
+            "sqli": settings_hash(SQLMAP_TIERS if tiered else FULL_SCAN),
+        }
+        self.queues = {bucket: queue.Queue(maxsize=queue_size) for bucket in self.settings}
+        self.stats = {bucket: {"queued": 0, "skipped": 0, "findings": 0} for bucket in self.settings}
+        self.started_at = None
+        # One LFI time budget for the whole stage, not one per batch
+        self.lfi_deadline = None
+        self.first_finding_at = None
+        self._writers = {}
+        self._reflections = None
+        self._lock = threading.Lock()
+
+    def record(self, category, finding, save=True):
+        with self._lock:
+            if self.first_finding_at is None:
+                self.first_finding_at = time.monotonic()
+                print(f"[pipeline] First finding ({category}) after {self.first_finding_at - self.started_at:.1f}s")
+            self.stats[category]["findings"] += 1
+            self._writers[category].write(finding)
+        if save:
+            storage.save_findings(category, [finding])
+
+    def classify(self, urls):
+        # One pass per URL: gf buckets, injection-point dedup, tested cache
+        engine = get_engine()
+        ttl = get_tested_ttl()
+        seen = {bucket: set() for bucket in self.queues}
+        tested = {
+            bucket: set() if self.force_rescan else storage.get_tested(bucket, settings, ttl)
+            for bucket, settings in self.settings.items()
+        }
+        try:
+            for url in urls:
+                for bucket in engine.classify(url):
+                    if bucket not in self.queues:
+                        continue
+                    key = signature_key(fuzz_url(url) if bucket == "lfi" else url)
+                    if key in seen[bucket] or key in tested[bucket]:
+                        self.stats[bucket]["skipped"] += 1
+                        continue
+                    seen[bucket].add(key)
+                    self.stats[bucket]["queued"] += 1
+                    self.queues[bucket].put(url)
+        finally:
+            # Unsubscribe so the crawler never blocks on a dead classifier
+            urls.close()
+            for bucket_queue in self.queues.values():
+                bucket_queue.put(_DONE)
+
+    def scan_lfi(self, urls):
+        for index, batch in enumerate(iter_batches(urls, 50, 5)):
+            lfi_file = os.path.join(self.work_dir, f"lfi_batch{index}.lfi")
+            with open(lfi_file, "w") as file:
+                for url in sorted({fuzz_url(url) for url in batch}):
+                    file.write(url + "\n")
+            fuzz_lfi_file(
+                lfi_file, self.payloads_file, on_result=lambda finding: self.record("lfi", finding),
+                mode=self.lfi_mode, workers=self.lfi_workers, deadline=self.lfi_deadline,
+                engine=self.lfi_engine, settings=self.settings["lfi"],
+            )
+            os.remove(lfi_file)
+
+    def scan_xss(self, urls):
+        for index, batch in enumerate(iter_batches(urls, 100, 10)):
+            batch_dir = os.path.join(self.work_dir, f"xss_batch{index}")
+            scan_urls = batch
+            if self.xss_precheck:
+                scan_urls, reflections, _ = prune_unreflected(batch)
+                with self._lock:
+                    for reflection in reflections:
+                        self._reflections.write(reflection)
+            # Pruned URLs count as tested, the rest once both tools completed on them
+            scanned = set(scan_urls)
+            tested = [url for url in batch if url not in scanned]
+            run_xss_tools(
+                scan_urls, batch_dir, self.xss_workers,
+                on_finding=lambda finding: self.record("xss", finding), on_tested=tested.extend,
+            )
+            mark_tested(tested, "xss", self.settings["xss"])
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+    def scan_sqli(self, urls):
+        host_slots = {}
+        host_slots_lock = threading.Lock()
+
+        def host_slot(url):
+            with host_slots_lock:
+                return host_slots.setdefault(storage.host_of(url), threading.Semaphore(self.sqlmap_per_host))
+
+        with sqlmap_run(self.cancel) as run:
+            def worker():
+                while not run.cancelled.is_set():
+                    url = urls.get()
+                    if url is _DONE:
+                        # Let the other workers see the end of the queue too
+                        urls.put(_DONE)
+                        return
+                    try:
+                        with host_slot(url):
+                            parsed_entry, completed = scan_url(url, run, self.tiered)
+                        if run.cancelled.is_set():
+                            return
+                        if completed:
+                            mark_tested([url], "sqli", self.settings["sqli"])
+                        if parsed_entry:
+                            save_parsed_entry(parsed_entry)
+                            self.record("sqli", parsed_entry, save=False)
+                    except Exception as e:
+                        print(f"[pipeline] sqlmap scan of {url} failed: {e}")
+
+            workers = [threading.Thread(target=worker) for _ in range(self.sqlmap_workers)]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+
+    def _run_stage(self, name, stage, urls):
+        try:
+            stage(urls)
+        except Exception as e:
+            print(f"[pipeline] {name} stage failed: {e}")
+        finally:
+            # Every stage leaves the end marker in its queue; draining up to it
+            # keeps a failed or cancelled stage from blocking the classifier
+            while urls.get() is not _DONE:
+                pass
+
+    def run(self):
+        self.started_at = time.monotonic()
+        self.lfi_deadline = self.started_at + self.lfi_budget
+        os.makedirs(self.work_dir, exist_ok=True)
+        for category in self.queues:
+            results_dir = os.path.join("results", category)
+            self._writers[category] = NdjsonWriter(os.path.join(results_dir, f"{category}_pipeline_results.ndjson"))
+        # Which parameters reflect and where; not findings, so outside results/xss
+        self._reflections = NdjsonWriter(os.path.join("results", "reflections", "reflections_pipeline.ndjson"))
+
+        # Subscribed before the crawl starts, so nothing needs replaying;
+        # bounded for backpressure
+        stream = UrlStream(replay=0)
+        urls = stream.subscribe(maxsize=self.queue_size)
+        threads = [
+            threading.Thread(target=run_crawler, args=(self.target_domain, stream), name="pipeline-crawler"),
+            threading.Thread(target=self.classify, args=(urls,), name="pipeline-classifier"),
+        ]
+        stages = {"lfi": self.scan_lfi, "xss": self.scan_xss, "sqli": self.scan_sqli}
+        for bucket, stage in stages.items():
+            threads.append(threading.Thread(
+                target=self._run_stage, args=(bucket, stage, self.queues[bucket]), name=f"pipeline-{bucket}"
+            ))
+
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            # A crawler that died without closing its stream must not leave the classifier waiting
+            stream.close()
+            for writer in self._writers.values():
+                writer.close()
+            self._reflections.close()
+
+        elapsed = time.monotonic() - self.started_at
+        for bucket, stats in self.stats.items():
+            print(
+                f"[pipeline] {bucket}: {stats['queued']} injection points queued, "
+                f"{stats['skipped']} duplicate or recently tested, {stats['findings']} findings"
+            )
+        print(f"[pipeline] Finished in {elapsed:.1f}s")
+        return self.stats
+
+
+@task(provides=("urls", "lfi", "xss", "sqli"))
+def run_pipeline(target_domain, payloads_file="/opt/smalllfi.txt", force_rescan=False, lfi_engine="ffuf",
+                 lfi_mode="batch", lfi_workers=4, lfi_budget=600, sqlmap_workers=None, tiered=True, xss_workers=4,
+                 xss_precheck=True, sqlmap_per_host=None, cancel=None):
+    pipeline = ScanPipeline(
+        target_domain,
+        payloads_file,
+        force_rescan=force_rescan,
+        lfi_engine=lfi_engine,
+        lfi_mode=lfi_mode,
+        lfi_workers=lfi_workers,
+        lfi_budget=lfi_budget,
+        sqlmap_workers=sqlmap_workers,
+        tiered=tiered,
+        xss_workers=xss_workers,
+        xss_precheck=xss_precheck,
+        sqlmap_per_host=sqlmap_per_host,
+        cancel=cancel,
+    )
+    return pipeline.run()
+
+
+if __name__ == "__main__":
+    run_pipeline("testphp.vulnweb.com")
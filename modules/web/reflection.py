@@ -0,0 +1,172 @@
+import asyncio
+import secrets
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from .hosts import build_client
+
+# Where a reflected canary landed in the response
+CONTEXTS = ("html", "attribute", "script")
+
+
+def inject_canaries(url):
+    """
+    Replaces the value of every query parameter with its own random canary.
+    Returns the URL to request and a {canary: parameter} map.
+    """
+    parts = urlsplit(url)
+    params = parse_qsl(parts.query, keep_blank_values=True)
+    canaries = {}
+    injected = []
+    for name, _ in params:
+        canary = f"xr{secrets.token_hex(5)}"
+        canaries[canary] = name
+        injected.append((name, canary))
+    return urlunsplit(parts._replace(query=urlencode(injected))), canaries
+
+
+def reflection_contexts(body, canary):
+    # Classifies every occurrence by the nearest unclosed <script> or tag before it
+    lowered = body.lower()
+    contexts = set()
+    position = lowered.find(canary)
+    while position != -1:
+        before = lowered[:position]
+        if before.rfind("<script") > before.rfind("</script"):
+            contexts.add("script")
+        elif before.rfind("<") > before.rfind(">"):
+            contexts.add("attribute")
+        else:
+            contexts.add("html")
+        position = lowered.find(canary, position + len(canary))
+    return sorted(contexts)
+
+
+async def check_reflection(client, url):
+    target, canaries = inject_canaries(url)
+    try:
+        response = await client.get(target, follow_redirects=True)
+    except Exception as e:
+        print(f"Error checking reflection on {url}: {e}")
+        return None
+    body = response.text
+    reflected = {}
+    for canary, name in canaries.items():
+        contexts = reflection_contexts(body, canary)
+        if contexts:
+            reflected[name] = contexts
+    return {"url": url, "status": response.status_code, "reflected": reflected}
+
+
+async def check_reflections(urls, concurrency=100, per_host=10, timeout=10.0, on_result=None):
+    """
+    Requests every URL once with a canary in each parameter over one pooled
+    client, at most `concurrency` requests in flight and `per_host` per host.
+    Returns {url: result}, where result is None when the request failed.
+    """
+    results = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    pending_per_host = {}
+    for url in urls:
+        pending_per_host.setdefault(urlsplit(url).netloc, []).append(url)
+
+    async with build_client(timeout=timeout, max_connections=concurrency) as client:
+        async def drain(pending):
+            # One of at most per_host workers of a host, holding a global slot
+            # only while its request is in flight
+            for url in pending:
+                async with semaphore:
+                    result = await check_reflection(client, url)
+                results[url] = result
+                if on_result is not None:
+                    on_result(url, result)
+
+        workers = []
+        for host_urls in pending_per_host.values():
+            pending = iter(host_urls)
+            workers.extend(drain(pending) for _ in range(min(per_host, len(host_urls))))
+        if workers:
+            await asyncio.gather(*workers)
+    return results
+
+
+def prune_unreflected(urls, concurrency=100, per_host=10, timeout=10.0):
+    """
+    Keeps the URLs with at least one reflected parameter, plus the ones that
+    could not be checked (no query or a failed request) so the pre-check never
+    hides a finding. Returns (kept URLs, reflection records, stats) and prints
+    the pruning ratio.
+    """
+    checkable = [url for url in urls if urlsplit(url).query]
+    results = asyncio.run(check_reflections(checkable, concurrency=concurrency, per_host=per_host, timeout=timeout))
+
+    kept = []
+    records = []
+    stats = {"total": len(urls), "reflecting": 0, "unchecked": 0, "pruned": 0}
+    for url in urls:
+        result = results.get(url)
+        if result is None:
+            stats["unchecked"] += 1
+            kept.append(url)
+        elif result["reflected"]:
+            stats["reflecting"] += 1
+            kept.append(url)
+            records.append(result)
+        else:
+            stats["pruned"] += 1
+
+    if stats["total"]:
+        print(
+            f"Reflection pre-check: {stats['reflecting']} of {stats['total']} URLs reflect a parameter, "
+            f"{stats['unchecked']} unchecked, {stats['pruned']} pruned "
+            f"({stats['pruned'] / stats['total']:.1%} fewer URLs for XSSVibe and Dalfox)"
+        )
+    return kept, records, stats
+
+
+if __name__ == "__main__":
+    # Times the pre-check against a local HTTP server where one page in
+    # `step` reflects its parameter:
+    #   python -m modules.web.reflection [url_count] [step]
+    import sys
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            value = dict(parse_qsl(parts.query)).get("q", "")
+            page = int(parts.path[len("/page"):] or 0)
+            templates = [
+                "<p>{}</p>",
+                '<input value="{}">',
+                "<script>var q = '{}';</script>",
+            ]
+            if page % step == 0:
+                body = templates[page // step % len(templates)].format(value)
+            else:
+                body = "<p>nothing reflected</p>"
+            body = body.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    url_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    step = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    urls = [f"{base}/page{i}?q=test&id={i}" for i in range(url_count)]
+    started = time.perf_counter()
+    kept, records, stats = prune_unreflected(urls)
+    elapsed = time.perf_counter() - started
+    contexts = {context: sum(context in contexts for record in records for contexts in record["reflected"].values())
+                for context in CONTEXTS}
+    print(f"{url_count} URLs checked in {elapsed:.2f}s ({url_count / elapsed:.0f} req/s), contexts: {contexts}")
+    server.shutdown()
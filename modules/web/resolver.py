@@ -0,0 +1,259 @@
+import asyncio
+import json
+import os
+import random
+import string
+import struct
+import time
+from ..tasks import task
+from .hosts import get_subdomains_from_directory
+
+QTYPE_A = 1
+QTYPE_CNAME = 5
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+
+FALLBACK_NAMESERVERS = [("1.1.1.1", 53), ("8.8.8.8", 53)]
+
+
+def load_nameservers(resolv_conf="/etc/resolv.conf"):
+    # DNS_RESOLVERS=ip[:port],ip[:port] overrides the system resolvers
+    configured = os.getenv("DNS_RESOLVERS")
+    if configured:
+        nameservers = []
+        for entry in configured.split(","):
+            host, _, port = entry.strip().partition(":")
+            nameservers.append((host, int(port or 53)))
+        return nameservers
+
+    nameservers = []
+    try:
+        with open(resolv_conf, "r") as file:
+            for line in file:
+                parts = line.split()
+                # Only IPv4 resolvers, the query socket is AF_INET
+                if len(parts) >= 2 and parts[0] == "nameserver" and ":" not in parts[1]:
+                    nameservers.append((parts[1], 53))
+    except FileNotFoundError:
+        pass
+    return nameservers or FALLBACK_NAMESERVERS
+
+
+def build_query(query_id, name, qtype=QTYPE_A):
+    header = struct.pack(">HHHHHH", query_id, 0x0100, 1, 0, 0, 0)  # recursion desired
+    question = b"".join(
+        bytes([len(label)]) + label.encode("idna") for label in name.strip(".").split(".")
+    ) + b"\x00"
+    return header + question + struct.pack(">HH", qtype, 1)
+
+
+def _skip_name(data, offset):
+    while True:
+        length = data[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:  # compression pointer
+            return offset + 2
+        offset += length + 1
+
+
+def parse_response(data):
+    """
+    Returns (query_id, rcode, ips, ttl) from a raw DNS response, keeping only
+    the A records of the answer section (CNAME chains are resolved upstream).
+    """
+    query_id, flags, qdcount, ancount, _, _ = struct.unpack(">HHHHHH", data[:12])
+    rcode = flags & 0x000F
+    offset = 12
+    for _ in range(qdcount):
+        offset = _skip_name(data, offset) + 4
+
+    ips = []
+    ttl = None
+    for _ in range(ancount):
+        offset = _skip_name(data, offset)
+        rtype, _, record_ttl, rdlength = struct.unpack(">HHIH", data[offset:offset + 10])
+        offset += 10
+        if rtype == QTYPE_A and rdlength == 4:
+            ips.append(".".join(str(b) for b in data[offset:offset + 4]))
+            ttl = record_ttl if ttl is None else min(ttl, record_ttl)
+        offset += rdlength
+    return query_id, rcode, ips, ttl
+
+
+class _DnsProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.pending = {}
+
+    def datagram_received(self, data, addr):
+        try:
+            query_id = struct.unpack(">H", data[:2])[0]
+        except struct.error:
+            return
+        future = self.pending.pop(query_id, None)
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+        pass
+
+
+class AsyncResolver:
+    """
+    Minimal async stub resolver: every query of a run goes out over one UDP
+    socket, answers are matched by query id and cached by name until their
+    TTL expires. Point it at a local server through `nameservers` to test.
+    """
+
+    def __init__(self, nameservers=None, timeout=2.0, retries=2, concurrency=200, negative_ttl=300):
+        self.nameservers = nameservers or load_nameservers()
+        self.timeout = timeout
+        self.retries = retries
+        self.negative_ttl = negative_ttl
+        self.cache = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._transport = None
+        self._protocol = None
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        self._transport, self._protocol = await loop.create_datagram_endpoint(
+            _DnsProtocol, local_addr=("0.0.0.0", 0)
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._transport.close()
+
+    def _new_query_id(self):
+        while True:
+            query_id = random.randint(0, 0xFFFF)
+            if query_id not in self._protocol.pending:
+                return query_id
+
+    async def resolve(self, name):
+        name = name.strip().lower().rstrip(".")
+        cached = self.cache.get(name)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        ips = []
+        ttl = self.negative_ttl
+        try:
+            build_query(0, name)
+        except (UnicodeError, ValueError) as e:
+            print(f"Skipping invalid name {name!r}: {e}")
+            self.cache[name] = (time.monotonic() + ttl, ips)
+            return ips
+
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                nameserver = self.nameservers[attempt % len(self.nameservers)]
+                query_id = self._new_query_id()
+                future = asyncio.get_running_loop().create_future()
+                self._protocol.pending[query_id] = future
+                self._transport.sendto(build_query(query_id, name), nameserver)
+                try:
+                    data = await asyncio.wait_for(future, self.timeout)
+                except asyncio.TimeoutError:
+                    self._protocol.pending.pop(query_id, None)
+                    continue
+                try:
+                    _, rcode, ips, answer_ttl = parse_response(data)
+                except (struct.error, IndexError):
+                    # Truncated or malformed reply: ask again
+                    ips = []
+                    continue
+                if rcode in (RCODE_NOERROR, RCODE_NXDOMAIN):
+                    if ips and answer_ttl is not None:
+                        ttl = answer_ttl
+                    break
+
+        self.cache[name] = (time.monotonic() + ttl, ips)
+        return ips
+
+
+def random_label(length=12):
+    return "".join(random.choices(string.ascii_lowercase + string.digits, k=length))
+
+
+def parent_zones(name, scope=None):
+    """
+    a.b.example.com -> b.example.com, example.com (never a bare TLD). With a
+    scope, only the zones at or below it: a wildcard on a public suffix or
+    a parent above the target says nothing about in-scope hosts.
+    """
+    labels = name.split(".")
+    zones = [".".join(labels[i:]) for i in range(1, len(labels) - 1)]
+    if scope:
+        scope = scope.strip().lower().rstrip(".")
+        zones = [zone for zone in zones if zone == scope or zone.endswith("." + scope)]
+    return zones
+
+
+async def resolve_names(subdomains, nameservers=None, concurrency=200, scope=None):
+    """
+    Resolves every name concurrently and drops the ones that do not resolve
+    or only point at the addresses a wildcard record returns for a random
+    label in one of their parent zones (at or below scope, when given).
+    """
+    live = {}
+    stats = {"total": 0, "dead": 0, "wildcard": 0, "live": 0}
+    names = list(dict.fromkeys(s.strip().lower().rstrip(".") for s in subdomains if s.strip()))
+    stats["total"] = len(names)
+
+    async with AsyncResolver(nameservers=nameservers, concurrency=concurrency) as resolver:
+        zones = {zone for name in names for zone in parent_zones(name, scope)}
+        zone_list = sorted(zones)
+        wildcard_results = await asyncio.gather(
+            *(resolver.resolve(f"{random_label()}.{zone}") for zone in zone_list)
+        )
+        wildcards = {zone: set(ips) for zone, ips in zip(zone_list, wildcard_results) if ips}
+        for zone in wildcards:
+            print(f"[!] Wildcard DNS detected for *.{zone}")
+
+        resolved = await asyncio.gather(*(resolver.resolve(name) for name in names))
+
+    for name, ips in zip(names, resolved):
+        if not ips:
+            stats["dead"] += 1
+            continue
+        if any(zone in wildcards and set(ips) <= wildcards[zone] for zone in parent_zones(name, scope)):
+            stats["wildcard"] += 1
+            continue
+        live[name] = sorted(set(ips))
+        stats["live"] += 1
+    return live, stats
+
+
+@task(requires=("subdomains",), provides=("resolved",))
+def resolve_subdomains(subdomains_dir="results/subdomains", output_dir="results/dns", nameservers=None, target_domain=None):
+    os.makedirs(output_dir, exist_ok=True)
+    subdomains = get_subdomains_from_directory(subdomains_dir)
+
+    live, stats = asyncio.run(resolve_names(subdomains, nameservers=nameservers, scope=target_domain))
+
+    # run_httpx reads every .txt in this directory
+    live_file_path = os.path.join(output_dir, "live_subdomains.txt")
+    with open(live_file_path, "w") as file:
+        for host in sorted(live):
+            file.write(host + "\n")
+
+    resolved_file_path = os.path.join(output_dir, "resolved_hosts.json")
+    with open(resolved_file_path, "w") as file:
+        json.dump(
+            {"stats": stats, "hosts": [{"host": host, "ips": ips} for host, ips in sorted(live.items())]},
+            file,
+            indent=4,
+        )
+
+    print(
+        f"[+] Resolved {stats['total']} names: {stats['live']} live, "
+        f"{stats['dead']} dead, {stats['wildcard']} wildcard"
+    )
+    print(f"[+] Live subdomains saved to {live_file_path}")
+    return live
+
+
+if __name__ == "__main__":
+    resolve_subdomains()
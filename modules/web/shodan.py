@@ -1,6 +1,8 @@
 import shodan
 import json
 import os
+from ..tasks import task
+from .. import storage
 
 def filter_results(matches):
     """Extract and return filtered information from Shodan search results."""
@@ -22,6 +24,7 @@ def filter_results(matches):
         filtered_results.append(filtered_result)
     return filtered_results
 
+@task(provides=("shodan",))
 def shodan_search(api_key, query, output_dir='results/shodan'):
     api = shodan.Shodan(api_key)
     os.makedirs(output_dir, exist_ok=True)
@@ -34,6 +37,8 @@ def shodan_search(api_key, query, output_dir='results/shodan'):
         # Filter the results to include only the relevant information
         filtered_results = filter_results(results['matches'])
         
+        storage.save_findings('shodan', filtered_results)
+
         # Save the filtered results to a JSON file
         with open(output_file_path, 'w') as file:
             json.dump(filtered_results, file, indent=4)
@@ -2,8 +2,19 @@ import subprocess
 import os
 import json
 import logging
-from threading import Thread
-from queue import Queue
+import gzip
+import hashlib
+import re
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from ..tasks import task
+from .. import storage
+from ..ndjson import NdjsonWriter, ndjson_path
+from .patterns import filter_urls
+from .corpus import get_corpus
+from .dedup import dedupe_file, settings_hash, skip_tested, mark_tested
 
 # Set up logging for debugging and progress monitoring
 def setup_logger():
@@ -11,139 +22,337 @@ def setup_logger():
     logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
     return logger
 
-# Run gau to collect URLs from the given domain
+# Collect historical URLs for the given domain from the shared corpus, which
+# only runs gau when the crawler has not already fetched them
 def run_gau(target_domain, output_file):
     logger = setup_logger()
-    command = ["gau", target_domain, "--o", output_file]
-    try:
-        subprocess.run(command, check=True)
-        logger.info(f"gau completed for {target_domain}, results saved to {output_file}")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Failed to run gau for {target_domain}: {str(e)}")
+    get_corpus().export(target_domain, output_file)
+    logger.info(f"Historical URLs for {target_domain} saved to {output_file}")
 
-# Filter SQL injection-prone URLs using gf
+# Filter SQL injection-prone URLs with the gf sqli patterns
 def filter_sqli_urls(input_file, output_file):
     logger = setup_logger()
-    command = ["gf", "sqli", input_file]
-    with open(output_file, 'w') as outfile:
-        subprocess.run(command, stdout=outfile)
-        logger.info(f"Filtered SQLi URLs and written to {output_file}")
+    filter_urls(input_file, output_file, "sqli")
+    dedupe_file(output_file)
+    logger.info(f"Filtered SQLi URLs and written to {output_file}")
 
-# Function to run sqlmap on a single URL
-def run_sqlmap_on_url(url, output_queue):
-    logger = setup_logger()
-    command = [
-        "sqlmap",
-        "-u", url,
-        "--level", "5",
-        "--risk", "3",
-        "--batch",
-        "--dbms", "mysql",
-        "--tamper", "between"
-    ]
+# Number of concurrent sqlmap processes when none is configured; every
+# sqlmap is a separate Python interpreter, so scale with the cores
+def default_sqlmap_workers():
+    return max(2, min(16, (os.cpu_count() or 1) * 2))
+
+class SqlmapRun:
+    """
+    Tracks the sqlmap processes started by one scan so a cancellation can
+    kill them instead of leaving orphans behind.
+    """
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self.processes = set()
+        self._lock = threading.Lock()
+
+    def start(self, command):
+        with self._lock:
+            if self.cancelled.is_set():
+                return None
+            process = subprocess.Popen(
+                command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace"
+            )
+            self.processes.add(process)
+            return process
+
+    def finished(self, process):
+        with self._lock:
+            self.processes.discard(process)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled.set()
+            processes = list(self.processes)
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+
+@contextmanager
+def sqlmap_run(cancel=None):
+    """
+    Yields a SqlmapRun whose processes are killed when the block raises,
+    including Ctrl-C, or when the optional cancel event is set, so an
+    aborted scan leaves no sqlmap behind.
+    """
+    run = SqlmapRun()
+    finished = threading.Event()
 
+    def watch():
+        while not finished.is_set():
+            if cancel.wait(0.5):
+                run.cancel()
+                return
+
+    if cancel is not None:
+        threading.Thread(target=watch, daemon=True).start()
     try:
-        result = subprocess.run(command, check=True, capture_output=True, text=True, timeout=60)
-        output_queue.put((url, result.stdout))
-        logger.info(f"sqlmap completed for {url}")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Failed to run sqlmap on {url}: {str(e)}")
-        output_queue.put((url, None))
-    except subprocess.TimeoutExpired:
-        logger.warning(f"sqlmap scan timed out for {url}")
-        output_queue.put((url, "Timeout expired"))
-
-# Thread worker function
-def worker(url_queue, output_queue):
-    while not url_queue.empty():
-        url = url_queue.get()
-        run_sqlmap_on_url(url, output_queue)
-        url_queue.task_done()
-
-# Main function to handle threads and process URLs
-def run_sqlmap_on_all_urls(sqli_file, json_output):
-    urls = []
-    with open(sqli_file, 'r') as file:
-        urls = [line.strip() for line in file if line.strip()]
+        yield run
+    except BaseException:
+        run.cancel()
+        raise
+    finally:
+        finished.set()
 
-    url_queue = Queue()
-    output_queue = Queue()
+# sqlmap settings per tier: every URL gets the fast first pass, only the
+# parameters it flagged are retested with the expensive settings
+SQLMAP_TIERS = [
+    {"tier": 1, "args": ["--level", "1", "--risk", "1", "--smart"], "timeout": 60},
+    {"tier": 2, "args": ["--level", "5", "--risk", "3", "--tamper", "between,randomcase,space2comment"], "timeout": 300},
+]
+# Single pass used when tiering is turned off
+FULL_SCAN = {"tier": "full", "args": ["--level", "5", "--risk", "3", "--dbms", "mysql", "--tamper", "between"], "timeout": 60}
 
-    for url in urls:
-        url_queue.put(url)
+HEURISTIC_PARAMETER_PATTERNS = [
+    re.compile(r"heuristic \(basic\) test shows that \S+ parameter '([^']+)' might be injectable"),
+    re.compile(r"\S+ parameter '([^']+)' appears to be '.*' injectable"),
+    re.compile(r"\S+ parameter '([^']+)' is '.*' injectable"),
+]
+HEURISTIC_DBMS_PATTERNS = [
+    re.compile(r"back-end DBMS could be '([^']+)'"),
+    re.compile(r"possible DBMS: '([^']+)'"),
+    re.compile(r"back-end DBMS is '([^']+)'"),
+]
 
-    # Start a pool of threads
-    threads = []
-    for _ in range(10):  # Adjust number of threads based on your needs
-        t = Thread(target=worker, args=(url_queue, output_queue))
-        t.start()
-        threads.append(t)
+class SqlmapOutputParser:
+    """
+    Pulls the finding fields and the heuristic signals out of sqlmap output
+    one line at a time, so nothing but those fields is kept in memory.
+    """
 
-    for t in threads:
-        t.join()
+    def __init__(self):
+        self.vulnerability_info = {}
+        # Parameters sqlmap flagged as possibly injectable, and its DBMS guess
+        self.params = []
+        self.dbms_hint = None
+        # Set by run_sqlmap_on_url once sqlmap exited cleanly within its budget
+        self.completed = False
 
-    url_queue.join()
+    def feed(self, line):
+        if "Payload:" in line:
+            self.vulnerability_info["payload"] = line.split("Payload:")[1].strip()
+        elif "back-end DBMS:" in line:
+            dbms_info = line.split("back-end DBMS:")[1].strip()
+            if '>=' in dbms_info:
+                dbms, version = dbms_info.split('>=')
+                self.vulnerability_info["dbms"] = dbms.strip()
+                self.vulnerability_info["dbms_version"] = version.strip()
+            else:
+                self.vulnerability_info["dbms"] = dbms_info.strip()
+        elif "web server operating system:" in line:
+            self.vulnerability_info["server_os"] = line.split("web server operating system:")[1].strip()
 
-    # Collect all results
-    results = []
-    while not output_queue.empty():
-        url, output = output_queue.get()
-        if output:
-            results.append({"url": url, "output": output})
+        for pattern in HEURISTIC_PARAMETER_PATTERNS:
+            match = pattern.search(line)
+            if match and match.group(1) not in self.params:
+                self.params.append(match.group(1))
+        for pattern in HEURISTIC_DBMS_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                self.dbms_hint = match.group(1)
 
-    # Save results to JSON
-    with open(json_output, 'w') as json_file:
-        json.dump(results, json_file, indent=4)
-    parse_directory_json(json_output)
+    def entry(self, url):
+        if not self.vulnerability_info:  # Add only if there's meaningful info
+            return None
+        return {"url": url, "vulnerabilities": [dict(self.vulnerability_info)]}
 
-def parse_directory_json(json_output):
-    with open(json_output, 'r') as file:
-        data = json.load(file)
+def raw_log_path(raw_log_dir, url, tier):
+    digest = hashlib.sha1(url.encode()).hexdigest()[:16]
+    return os.path.join(raw_log_dir, f"{digest}.tier{tier}.log.gz")
 
-    parsed_data = []
-    for entry in data:
-        outputs = entry["output"].split('\n')
-        parsed_entry = {"url": entry["url"], "vulnerabilities": []}
-        vulnerability_info = {}
+# Function to run sqlmap on a single URL; returns the parser fed with its
+# output as it streamed in, or None when the run was cancelled
+def run_sqlmap_on_url(url, run, tier=FULL_SCAN, extra_args=(), raw_log_dir=None):
+    logger = setup_logger()
+    command = ["sqlmap", "-u", url, "--batch", *tier["args"], *extra_args]
+
+    process = run.start(command)
+    if process is None:
+        return None
 
-        for line in outputs:
-            if "Payload:" in line:
-                vulnerability_info["payload"] = line.split("Payload:")[1].strip()
-            elif "back-end DBMS:" in line:
-                dbms_info = line.split("back-end DBMS:")[1].strip()
-                if '>=' in dbms_info:
-                    dbms, version = dbms_info.split('>=')
-                    vulnerability_info["dbms"] = dbms.strip()
-                    vulnerability_info["dbms_version"] = version.strip()
-                else:
-                    vulnerability_info["dbms"] = dbms_info.strip()
-            elif "web server operating system:" in line:
-                vulnerability_info["server_os"] = line.split("web server operating system:")[1].strip()
+    timed_out = threading.Event()
 
-        if vulnerability_info:  # Add only if there's meaningful info
-            parsed_entry["vulnerabilities"].append(vulnerability_info)
-        
-        if parsed_entry["vulnerabilities"]:
-            parsed_data.append(parsed_entry)
+    def kill():
+        timed_out.set()
+        process.kill()
+
+    timer = threading.Timer(tier["timeout"], kill)
+    timer.start()
+    parser = SqlmapOutputParser()
+    raw_log = None
+    if raw_log_dir:
+        raw_log = gzip.open(raw_log_path(raw_log_dir, url, tier["tier"]), "wt")
+        raw_log.write(f"# {' '.join(command)}\n")
+    try:
+        for line in process.stdout:
+            parser.feed(line)
+            if raw_log is not None:
+                raw_log.write(line)
+        process.wait()
+    finally:
+        timer.cancel()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if raw_log is not None:
+            raw_log.close()
+        run.finished(process)
+
+    if run.cancelled.is_set():
+        return None
+    if timed_out.is_set():
+        # Whatever was confirmed before the budget ran out still counts
+        logger.warning(f"sqlmap tier {tier['tier']} scan timed out for {url}")
+    elif process.returncode != 0:
+        logger.error(f"sqlmap exited with status {process.returncode} on {url}")
+    else:
+        logger.info(f"sqlmap tier {tier['tier']} completed for {url}")
+        parser.completed = True
+    return parser
+
+def tag_tier(parsed_entry, tier):
+    for vulnerability in parsed_entry["vulnerabilities"]:
+        vulnerability["tier"] = tier
+    return parsed_entry
+
+def scan_url(url, run, tiered=True, raw_log_dir=None):
+    """
+    Returns (parsed sqlmap findings or None, completed) for url. Findings are
+    tagged with the tier that found them; completed is False when a sqlmap
+    run failed, timed out or was cancelled, so the URL is not cached as
+    tested. Escalates to the next tier only for the parameters the previous
+    one flagged.
+    """
+    logger = setup_logger()
+    if not tiered:
+        parser = run_sqlmap_on_url(url, run, FULL_SCAN, raw_log_dir=raw_log_dir)
+        if parser is None:
+            return None, False
+        parsed_entry = parser.entry(url)
+        return (tag_tier(parsed_entry, FULL_SCAN["tier"]) if parsed_entry else None), parser.completed
+
+    extra_args = ()
+    completed = True
+    for tier in SQLMAP_TIERS:
+        parser = run_sqlmap_on_url(url, run, tier, extra_args, raw_log_dir=raw_log_dir)
+        if parser is None:
+            return None, False
+        completed = completed and parser.completed
+        parsed_entry = parser.entry(url)
+        if parsed_entry:
+            return tag_tier(parsed_entry, tier["tier"]), completed
+
+        # A tier that timed out still escalates the parameters it flagged
+        if not parser.params:
+            return None, completed
+        logger.info(f"Escalating {url} past tier {tier['tier']} for parameters {', '.join(parser.params)}")
+        extra_args = ["-p", ",".join(parser.params)]
+        if parser.dbms_hint:
+            extra_args += ["--dbms", parser.dbms_hint]
+    return None, completed
+
+# Runs sqlmap on every URL on a bounded pool, at most per_host at a time
+# against the same host (by default as many as there are workers, so a
+# single target keeps the whole pool), and writes each result as soon as it completes;
+# with settings, every URL sqlmap completed goes into the tested-injection-point cache;
+# setting the cancel event kills the running sqlmap processes
+def run_sqlmap_on_all_urls(sqli_file, json_output, ndjson=False, workers=None, per_host=None, tiered=True, raw_log_dir=None, settings=None, cancel=None):
+    logger = setup_logger()
+    with open(sqli_file, 'r') as file:
+        urls = list(dict.fromkeys(line.strip() for line in file if line.strip()))
+
+    workers = workers or default_sqlmap_workers()
+    per_host = per_host or workers
+    pending = {}
+    for url in urls:
+        pending.setdefault(storage.host_of(url), deque()).append(url)
+    running_per_host = {host: 0 for host in pending}
+    logger.info(f"Running sqlmap on {len(urls)} URLs across {len(pending)} hosts with {workers} workers")
+
+    if raw_log_dir:
+        os.makedirs(raw_log_dir, exist_ok=True)
+    writer = NdjsonWriter(ndjson_path(json_output)) if ndjson else None
+    parsed_data = []
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor, sqlmap_run(cancel) as run:
+            futures = {}
 
-    with open(json_output, 'w') as file:
-        json.dump(parsed_data, file, indent=4)
+            def fill():
+                for host, queue in pending.items():
+                    while (
+                        queue and len(futures) < workers and running_per_host[host] < per_host
+                        and not run.cancelled.is_set()
+                    ):
+                        url = queue.popleft()
+                        futures[executor.submit(scan_url, url, run, tiered, raw_log_dir)] = (url, host)
+                        running_per_host[host] += 1
 
+            fill()
+            while futures and not run.cancelled.is_set():
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, host = futures.pop(future)
+                    running_per_host[host] -= 1
+                    try:
+                        parsed_entry, completed = future.result()
+                    except Exception as e:
+                        logger.error(f"sqlmap scan of {url} failed: {e}")
+                        continue
+                    if settings is not None and completed and not run.cancelled.is_set():
+                        mark_tested([url], "sqli", settings)
+                    if parsed_entry:
+                        save_parsed_entry(parsed_entry)
+                        if writer is not None:
+                            writer.write(parsed_entry)
+                        else:
+                            parsed_data.append(parsed_entry)
+                fill()
+    finally:
+        if writer is not None:
+            writer.close()
 
+    if run.cancelled.is_set():
+        logger.warning("sqlmap scan cancelled")
+    if writer is None:
+        # Written once; every entry is already in the results database as it completes
+        temp_output = json_output + ".tmp"
+        with open(temp_output, 'w') as json_file:
+            json.dump(parsed_data, json_file, indent=4)
+        os.replace(temp_output, json_output)
 
+def save_parsed_entry(parsed_entry):
+    storage.save_findings('sqli', [
+        {"url": parsed_entry["url"], **vulnerability}
+        for vulnerability in parsed_entry["vulnerabilities"]
+    ])
 
 # Main function to run gau, filter URLs, and execute sqlmap
-def sqli_scan(target_domain):
+@task(provides=("sqli",))
+def sqli_scan(target_domain, ndjson=False, workers=None, per_host=None, tiered=True, raw_logs=False, force_rescan=False, cancel=None):
     output_dir = "/mnt/d/flask-thesis/results/sqli"
     os.makedirs(output_dir, exist_ok=True)
 
     gau_file = os.path.join(output_dir, "fgau.txt")
     sqli_file = os.path.join(output_dir, "sqli_filtered.txt")
     json_output = os.path.join(output_dir, "sqli_results.json")
+    # Optional gzipped sqlmap output per URL and tier, for manual review
+    raw_log_dir = os.path.join(output_dir, "raw_logs") if raw_logs else None
 
     run_gau(target_domain, gau_file)
     filter_sqli_urls(gau_file, sqli_file)
-    run_sqlmap_on_all_urls(sqli_file, json_output)
+    settings = settings_hash(SQLMAP_TIERS if tiered else FULL_SCAN)
+    skip_tested(sqli_file, "sqli", settings, force_rescan)
+    run_sqlmap_on_all_urls(
+        sqli_file, json_output, ndjson=ndjson, workers=workers, per_host=per_host,
+        tiered=tiered, raw_log_dir=raw_log_dir, settings=settings, cancel=cancel,
+    )
 
 # Entry point for the script
 if __name__ == "__main__":
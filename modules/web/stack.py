@@ -1,46 +1,135 @@
 import subprocess
+import importlib.util
 import os
 import json
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ..tasks import task
+from .. import storage
+from ..ndjson import iter_ndjson
 
-def run_tech_stack_detection(hosts_dir='results/hosts', output_dir='results/techstack'):
-    os.makedirs(output_dir, exist_ok=True)
+# In-process fingerprinting needs the optional 'python-Wappalyzer' package;
+# without it every host goes through the wappy CLI
+WAPPALYZER_AVAILABLE = importlib.util.find_spec("Wappalyzer") is not None
+if WAPPALYZER_AVAILABLE:
+    from Wappalyzer import Wappalyzer, WebPage
+
+def load_online_hosts(hosts_dir):
+    # Prefer the probed hosts in the results database over the JSON files
+    online_hosts = storage.get_online_hosts()
+    if online_hosts:
+        return online_hosts
 
     for filename in os.listdir(hosts_dir):
         if filename.endswith('.json'):
             filepath = os.path.join(hosts_dir, filename)
             with open(filepath, 'r') as file:
                 hosts_data = json.load(file)
-                online_hosts = hosts_data.get('online', {})
-
-                for host, details in online_hosts.items():
+                for host, details in hosts_data.get('online', {}).items():
                     if details.get('status_code') in [200, 301]:
-                        output_filename = f"{host.replace('https://', '').replace('http://', '').replace('/', '_')}_tech_stack.txt"
-                        output_file = os.path.join(output_dir, output_filename)
-                        command = ['wappy', '-u', host]  # Update your command as needed
+                        online_hosts.append(host)
+        elif filename.endswith('.ndjson'):
+            for record in iter_ndjson(os.path.join(hosts_dir, filename)):
+                if record.get('status_code') in [200, 301]:
+                    online_hosts.append(record['host'])
+    return online_hosts
+
+# How long a detected stack is reused while the host's response stays the same, in hours
+DEFAULT_STACK_TTL_HOURS = 24
+
+def get_stack_ttl():
+    return float(os.getenv("TECHSTACK_TTL_HOURS", DEFAULT_STACK_TTL_HOURS)) * 3600
+
+_wappalyzer = None
+_wappalyzer_lock = threading.Lock()
+
+def get_wappalyzer():
+    # Loading the technology database is slow, so every worker shares one instance
+    global _wappalyzer
+    with _wappalyzer_lock:
+        if _wappalyzer is None:
+            _wappalyzer = Wappalyzer.latest()
+        return _wappalyzer
 
-                        try:
-                            with open(output_file, 'w') as f:
-                                subprocess.run(command, check=True, stdout=f, text=True)
-                            print(f"Tech stack detection output for {host} saved to {output_file}")
-                        except subprocess.CalledProcessError as e:
-                            print(f"Error detecting tech stack for {host}: {e}")
+def fingerprint_response(response):
+    """
+    Fingerprints a response from the prober's cache in-process. Returns the
+    stack in the shape parse_wappy_output_to_json produces: technologies
+    grouped by category.
+    """
+    webpage = WebPage(
+        response['url'],
+        response['body'].decode('utf-8', errors='replace'),
+        response['headers'],
+    )
+    tech_stack = {}
+    detected = get_wappalyzer().analyze_with_versions_and_categories(webpage)
+    for technology, info in sorted(detected.items()):
+        version = info['versions'][0] if info['versions'] else 'nil'
+        for category in info['categories']:
+            tech_stack.setdefault(category, []).append({'detail': technology, 'version': version})
+    return tech_stack
+
+def run_wappy(host):
+    command = ['wappy', '-u', host]  # Update your command as needed
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Error detecting tech stack for {host}: {e}")
+        return None
+    return parse_wappy_output_to_json(result.stdout)
+
+def detect_tech_stack(host, ttl):
+    """
+    Returns (stack, source) for host. A stack detected within ttl is reused
+    while the prober's response for host hashes the same. Otherwise the
+    cached response is fingerprinted in-process, falling back to wappy when
+    there is no usable response or the Wappalyzer package is missing.
+    """
+    response = storage.get_response(host)
+    if response is not None:
+        cached = storage.get_cached_stack(host, response['response_hash'], ttl)
+        if cached is not None:
+            return cached, 'cache'
 
-    compile_tech_stacks_to_json(output_dir)
+    # The prober follows redirects for the cached copy, so any 2xx is the page itself
+    if response is not None and 200 <= response['status_code'] < 300 and WAPPALYZER_AVAILABLE:
+        stack, source = fingerprint_response(response), 'response'
+    else:
+        stack, source = run_wappy(host), 'wappy'
 
-def compile_tech_stacks_to_json(output_dir):
+    if stack is not None and response is not None:
+        storage.save_cached_stack(host, response['response_hash'], stack)
+    return stack, source
+
+@task(requires=("hosts",), provides=("techstack",))
+def run_tech_stack_detection(hosts_dir='results/hosts', output_dir='results/techstack', workers=8):
+    os.makedirs(output_dir, exist_ok=True)
+    ttl = get_stack_ttl()
     all_tech_stacks = {}
+    sources = {'cache': 0, 'response': 0, 'wappy': 0}
 
-    for filename in os.listdir(output_dir):
-        if filename.endswith('_tech_stack.txt'):
-            filepath = os.path.join(output_dir, filename)
-            with open(filepath, 'r') as file:
-                text_output = file.read()
-                host = filename.replace('_tech_stack.txt', '').replace('_', '/')
-                tech_stack_data = parse_wappy_output_to_json(text_output)
-                all_tech_stacks[host] = tech_stack_data
-            os.remove(filepath)  # Optionally remove the .txt file
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(detect_tech_stack, host, ttl): host for host in load_online_hosts(hosts_dir)}
+        for future in as_completed(futures):
+            host = futures[future]
+            try:
+                tech_stack_data, source = future.result()
+            except Exception as e:
+                print(f"Error detecting tech stack for {host}: {e}")
+                continue
+            if tech_stack_data is None:
+                continue
+            sources[source] += 1
+            all_tech_stacks[host] = tech_stack_data
+            storage.save_findings('techstack', [{'host': host, 'stack': tech_stack_data}])
+            print(f"Tech stack for {host} detected ({source})")
 
+    print(
+        f"Tech stacks: {sources['cache']} unchanged since the last run, "
+        f"{sources['response']} fingerprinted from probed responses, {sources['wappy']} with wappy"
+    )
     compiled_results_file = os.path.join(output_dir, 'compiled_tech_stacks.json')
     with open(compiled_results_file, 'w') as file:
         json.dump(all_tech_stacks, file, indent=4)
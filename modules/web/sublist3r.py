@@ -2,6 +2,8 @@ import subprocess
 import os
 import json
 from pathlib import Path
+from .. import storage
+from ..tasks import task
 
 def run_command(command, output_file):
     try:
@@ -17,6 +19,7 @@ def run_command(command, output_file):
         print(f"Error running {command[0]}: {e}")
         return False
 
+@task(provides=("subdomains",))
 def find_subdomains(domain, output_folder="results/subdomains/"):
     Path(output_folder).mkdir(parents=True, exist_ok=True)
 
@@ -55,6 +58,8 @@ def find_subdomains(domain, output_folder="results/subdomains/"):
     with open(combined_json_output_file, 'w') as json_file:
         json.dump(list(sorted(subdomains)), json_file, indent=4)  # Convert to JSON
 
+    storage.add_subdomains(sorted(subdomains))
+
     print(f"[+] Sublist3r found {sublist3r_count} subdomains.")
     print(f"[+] Subfinder found {subfinder_count} subdomains.")
     print(f"[+] Combined unique subdomains: {len(subdomains)}")
@@ -0,0 +1,102 @@
+import queue
+import threading
+from collections import deque
+
+_CLOSED = object()
+# URLs replayed to a subscriber that attaches after publishing started
+DEFAULT_REPLAY = 1000
+
+
+class UrlStream:
+    """
+    Fan-out of the URLs a crawl produces. Every subscriber gets each URL
+    published after it subscribed, plus the last `replay` URLs published
+    before, and its iterator ends when the stream is closed. Only those are
+    kept, so memory does not grow with the crawl; subscribe before the crawl
+    starts to see all of it. A subscriber with a bounded queue makes
+    publish() wait for it (backpressure).
+    """
+
+    def __init__(self, replay=DEFAULT_REPLAY):
+        self._history = deque(maxlen=replay)
+        self._published = 0
+        self._subscribers = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def publish(self, url):
+        with self._lock:
+            if self._closed:
+                raise ValueError("publish() on a closed UrlStream")
+            self._history.append(url)
+            self._published += 1
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            self._deliver(subscriber, url)
+
+    def _deliver(self, subscriber, item):
+        # Blocks while a bounded subscriber is full, unless it unsubscribes
+        while True:
+            try:
+                subscriber.put(item, timeout=1)
+                return
+            except queue.Full:
+                with self._lock:
+                    if subscriber not in self._subscribers:
+                        return
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            self._deliver(subscriber, _CLOSED)
+
+    def subscribe(self, maxsize=0):
+        with self._lock:
+            backlog = list(self._history)
+            missed = self._published - len(backlog)
+            closed = self._closed
+            subscriber = queue.Queue(maxsize=maxsize)
+            if not closed:
+                self._subscribers.append(subscriber)
+        if missed:
+            print(f"Subscribed to a URL stream late, {missed} earlier URLs are not replayed")
+        return self._iterate(backlog, subscriber, closed)
+
+    def _iterate(self, backlog, subscriber, closed):
+        try:
+            yield from backlog
+            if closed:
+                return
+            while True:
+                url = subscriber.get()
+                if url is _CLOSED:
+                    return
+                yield url
+        finally:
+            with self._lock:
+                if subscriber in self._subscribers:
+                    self._subscribers.remove(subscriber)
+
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+
+def open_stream(name):
+    # A fresh stream for a crawl of `name`; replaces the one of a previous crawl
+    with _streams_lock:
+        stream = _streams[name] = UrlStream()
+        return stream
+
+
+def get_stream(name):
+    with _streams_lock:
+        return _streams.get(name)
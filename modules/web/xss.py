@@ -5,6 +5,13 @@ import glob
 import logging
 import re
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ..tasks import task
+from .. import storage
+from ..ndjson import NdjsonWriter, ndjson_path
+from .patterns import filter_urls
+from .dedup import dedupe_file, settings_hash, skip_tested, mark_tested
+from .reflection import prune_unreflected
 
 # Set up logging for debugging
 def setup_logger():
@@ -15,35 +22,51 @@ def setup_logger():
 # Extract URLs that contain known XSS vulnerabilities
 def filter_xss_urls(input_file, xss_file):
     logger = setup_logger()
-    with open(xss_file, 'w') as output:
-        command = ["gf", "xss", input_file]
-        subprocess.run(command, stdout=output)
+    filter_urls(input_file, xss_file, "xss")
+    dedupe_file(xss_file)
     logger.info(f"XSS URLs filtered and written to {xss_file}")
 
-# Run XSSVibe on the URLs
-def run_xssvibe(xss_output, xssvibe_results_file):
-    xssvibes_dir = "/opt/xss_vibes"
-    os.chdir(xssvibes_dir)
-    command = ["python3", "main.py", "-f", xss_output, "-o", xssvibe_results_file, "-t", "100"]
+# Identifies the tool settings in the tested-injection-point cache; change
+# it together with the XSSVibe and Dalfox options below
+XSS_SETTINGS = settings_hash("xssvibe -t 100", "dalfox --waf-evasion -F")
+
+XSSVIBE_DIR = "/opt/xss_vibes"
+# XSSVibe threads and Dalfox workers (its default) shared by all chunks, so
+# more XSS_WORKERS do not mean more load on the target
+XSSVIBE_THREADS = 100
+DALFOX_WORKERS = 100
+
+# Run XSSVibe on the URLs; returns whether it ran to completion
+def run_xssvibe(xss_output, xssvibe_results_file, threads=XSSVIBE_THREADS):
+    # Absolute paths and cwd= instead of os.chdir, which would move every other thread too
+    command = [
+        "python3", "main.py", "-f", os.path.abspath(xss_output),
+        "-o", os.path.abspath(xssvibe_results_file), "-t", str(threads),
+    ]
     try:
-        subprocess.run(command, check=True)
+        subprocess.run(command, check=True, cwd=XSSVIBE_DIR)
         print(f"XSSVibe successfully processed and output saved to {xssvibe_results_file}")
-    except subprocess.CalledProcessError as e:
+        return True
+    except (OSError, subprocess.CalledProcessError) as e:
         print(f"Failed to run XSSVibe: {e}")
+        return False
 
-# Run Dalfox on the URLs to find potential vulnerabilities
-def run_dalfox(xss_output, dalfox_results_file):
-    command = ["dalfox", "file", xss_output, "-o", dalfox_results_file, "--custom-alert-value", "calfcrusher", "--waf-evasion", "-F"]
+# Run Dalfox on the URLs to find potential vulnerabilities; returns whether it ran to completion
+def run_dalfox(xss_output, dalfox_results_file, workers=DALFOX_WORKERS):
+    command = [
+        "dalfox", "file", xss_output, "-o", dalfox_results_file, "--custom-alert-value", "calfcrusher",
+        "--waf-evasion", "-F", "--worker", str(workers),
+    ]
     try:
         subprocess.run(command, check=True)
         print(f"Dalfox output saved to {dalfox_results_file}")
-    except subprocess.CalledProcessError as e:
+        return True
+    except (OSError, subprocess.CalledProcessError) as e:
         print(f"Failed to run Dalfox: {e}")
+        return False
 
-# Extract vulnerable URLs from Dalfox results, focusing on [POC] tags
-def extract_dalfox_vulnerable_urls(dalfox_results_file):
-    logger = setup_logger()
-    vulnerable_urls = []
+# Yield vulnerable URLs from Dalfox results, focusing on [POC] tags
+def iter_dalfox_vulnerable_urls(dalfox_results_file):
     with open(dalfox_results_file, 'r') as file:
         for line in file:
             if "[POC]" in line:
@@ -51,56 +74,138 @@ def extract_dalfox_vulnerable_urls(dalfox_results_file):
                 if url_match:
                     url = url_match.group()
                     payload = line.strip()
-                    vulnerable_urls.append({
+                    yield {
                         "url": url,
                         "payload": payload
-                    })
-    return vulnerable_urls
+                    }
 
-# Compile results into a JSON output
-def compile_results_to_json(xss_dir, target_domain, final_json_output):
-    logger = setup_logger()
-    all_results = []
+# Extract vulnerable URLs from Dalfox results, focusing on [POC] tags
+def extract_dalfox_vulnerable_urls(dalfox_results_file):
+    return list(iter_dalfox_vulnerable_urls(dalfox_results_file))
 
-    # Extract from XSSVibe results
-    xssvibe_results_file = os.path.join(xss_dir, f"xssvibe_results_{target_domain}.txt")
+# Yield vulnerable URLs reported by XSSVibe
+def iter_xssvibe_vulnerable_urls(xssvibe_results_file):
     with open(xssvibe_results_file, 'r') as file:
         for line in file:
             url_match = re.search(r'https?://\S+', line)
             if url_match:
-                url = url_match.group()
-                all_results.append({
-                    "url": url,
+                yield {
+                    "url": url_match.group(),
                     "payload": "XSSVibe"
-                })
+                }
+
+# Split the URLs into at most `parts` chunks of near equal size
+def split_urls(urls, parts):
+    parts = max(1, min(parts, len(urls)))
+    return [urls[index::parts] for index in range(parts)]
+
+def run_xss_tools(urls, work_dir, workers=4, on_finding=None, on_tested=None):
+    """
+    Splits urls across `workers` chunks and runs XSSVibe and Dalfox on every
+    chunk at the same time. Findings are merged as each run finishes, one
+    per (url, payload), and passed to on_finding when given; on_tested gets
+    the URLs of every chunk both tools completed. Chunk files and raw tool
+    output are left in work_dir.
+    """
+    if not urls:
+        return []
+    os.makedirs(work_dir, exist_ok=True)
+    chunks = split_urls(urls, workers)
+    threads = max(1, XSSVIBE_THREADS // len(chunks))
+    dalfox_workers = max(1, DALFOX_WORKERS // len(chunks))
+    runs = []
+    for index, chunk in enumerate(chunks):
+        urls_file = os.path.join(work_dir, f"urls_chunk{index}.txt")
+        with open(urls_file, 'w') as file:
+            file.writelines(url + "\n" for url in chunk)
+        xssvibe_results_file = os.path.join(work_dir, f"xssvibe_chunk{index}.txt")
+        dalfox_results_file = os.path.join(work_dir, f"dalfox_chunk{index}.txt")
+        # Output of an earlier run must not be read back if a tool fails this time
+        for results_file in (xssvibe_results_file, dalfox_results_file):
+            if os.path.exists(results_file):
+                os.remove(results_file)
+        runs.append((run_xssvibe, (urls_file, xssvibe_results_file, threads), iter_xssvibe_vulnerable_urls, index))
+        runs.append((run_dalfox, (urls_file, dalfox_results_file, dalfox_workers), iter_dalfox_vulnerable_urls, index))
+
+    findings = {}
+    # Tool runs per chunk that completed, out of the two started
+    completed = [0] * len(chunks)
+    with ThreadPoolExecutor(max_workers=len(runs)) as executor:
+        futures = {executor.submit(run, *args): (args[1], parse, index) for run, args, parse, index in runs}
+        for future in as_completed(futures):
+            results_file, parse, index = futures[future]
+            if future.result():
+                completed[index] += 1
+                if completed[index] == 2 and on_tested is not None:
+                    on_tested(chunks[index])
+            if not os.path.exists(results_file):
+                continue
+            for finding in parse(results_file):
+                key = (finding["url"], finding["payload"])
+                if key in findings:
+                    continue
+                findings[key] = finding
+                if on_finding is not None:
+                    on_finding(finding)
+    return list(findings.values())
 
-    # Extract from Dalfox results with [POC]
-    dalfox_results_file = os.path.join(xss_dir, f"dalfox_results_{target_domain}.txt")
-    vulnerable_urls = extract_dalfox_vulnerable_urls(dalfox_results_file)
-    all_results.extend(vulnerable_urls)
+# Save the merged findings as JSON, or as NDJSON while they arrive
+def scan_xss_urls(urls, xss_dir, target_domain, final_json_output, ndjson=False, workers=4, on_tested=None):
+    logger = setup_logger()
+    work_dir = os.path.join(xss_dir, f"work_{target_domain}")
+
+    if ndjson:
+        final_ndjson_output = ndjson_path(final_json_output)
+        with NdjsonWriter(final_ndjson_output) as writer:
+            def on_finding(finding):
+                writer.write(finding)
+                storage.save_findings('xss', [finding])
+            run_xss_tools(urls, work_dir, workers, on_finding=on_finding, on_tested=on_tested)
+        logger.info(f"Compiled results streamed to {final_ndjson_output}")
+        return
+
+    all_results = run_xss_tools(urls, work_dir, workers, on_tested=on_tested)
+    storage.save_findings('xss', all_results)
 
     # Save to JSON
     with open(final_json_output, 'w') as file:
         json.dump(all_results, file, indent=4)
     logger.info(f"Compiled JSON results saved to {final_json_output}")
 
-def run_xss():
+@task(requires=("urls",), provides=("xss",))
+def run_xss(ndjson=False, force_rescan=False, workers=4, precheck=True):
     katana_dir = "/mnt/d/flask-thesis/results/katana"
     xss_dir = "/mnt/d/flask-thesis/results/xss"
+    reflections_dir = "/mnt/d/flask-thesis/results/reflections"
     os.makedirs(xss_dir, exist_ok=True)
 
     for katana_output in glob.glob(os.path.join(katana_dir, '*')):
         target_domain = os.path.basename(katana_output).replace("_", ".").replace(".txt", "")
         urls_xss_path = os.path.join(xss_dir, f"urls_xss_{target_domain}.txt")
-        xssvibe_results_file = os.path.join(xss_dir, f"xssvibe_results_{target_domain}.txt")
-        dalfox_results_file = os.path.join(xss_dir, f"dalfox_results_{target_domain}.txt")
         final_json_output = os.path.join(xss_dir, f"final_xss_results_{target_domain}.json")
 
         filter_xss_urls(katana_output, urls_xss_path)
-        run_xssvibe(urls_xss_path, xssvibe_results_file)
-        run_dalfox(urls_xss_path, dalfox_results_file)
-
-        compile_results_to_json(xss_dir, target_domain, final_json_output)
+        skip_tested(urls_xss_path, "xss", XSS_SETTINGS, force_rescan)
+        with open(urls_xss_path, 'r') as file:
+            urls = [url for url in file.read().splitlines() if url]
+        if not urls:
+            continue
+        scan_urls = urls
+        if precheck:
+            scan_urls, reflections, _ = prune_unreflected(urls)
+            # Not findings: kept out of the xss directory the dashboard reads
+            os.makedirs(reflections_dir, exist_ok=True)
+            with open(os.path.join(reflections_dir, f"reflections_{target_domain}.json"), 'w') as file:
+                json.dump(reflections, file, indent=4)
+        # Pruned URLs were answered without reflecting anything; the rest
+        # only count as tested once both tools completed on them
+        scanned = set(scan_urls)
+        tested = [url for url in urls if url not in scanned]
+        scan_xss_urls(
+            scan_urls, xss_dir, target_domain, final_json_output,
+            ndjson=ndjson, workers=workers, on_tested=tested.extend,
+        )
+        mark_tested(tested, "xss", XSS_SETTINGS)
 
 if __name__ == "__main__":
     run_xss()
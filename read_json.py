@@ -2,7 +2,10 @@ import os
 import json
 from flask import current_app
 import sys
+import threading
 from pathlib import Path
+from modules import storage
+from modules.ndjson import iter_ndjson
 
 # Get the directory containing app.py
 current_dir = Path(__file__).parent
@@ -12,45 +15,177 @@ parent_dir = current_dir.parent
 # Add the parent directory to sys.path
 sys.path.append(str(parent_dir))
 
+# Base path where scan directories are located
+base_path = os.path.join(parent_dir, "flask-thesis/results")  # Update this path
 
-def read_all_json_results(scan_directories):
+# Parsed (and optionally processed) results per scan directory, keyed by the
+# (path, mtime, size) of every JSON file that went into them
+_results_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_directory_signature(full_scan_path):
+    signature = []
+    if os.path.isdir(full_scan_path):
+        for filename in sorted(os.listdir(full_scan_path)):
+            if filename.endswith((".json", ".ndjson")):
+                file_path = os.path.join(full_scan_path, filename)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                signature.append((file_path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def invalidate_cache(scan_dir=None):
+    with _cache_lock:
+        if scan_dir is None:
+            _results_cache.clear()
+        else:
+            _results_cache.pop(scan_dir, None)
+
+
+def read_all_json_results(scan_directories, processors=None):
+    """
+    Returns the results of every scan directory, parsing its JSON files only
+    when one of them was added, removed or rewritten since the last call.
+    `processors` maps a directory to the function that normalizes its raw
+    results; the normalized table is what gets cached.
+    """
+    processors = processors or {}
     results = {}
-    # Base path where scan directories are located
-    base_path = os.path.join(parent_dir, "flask-thesis/results")  # Update this path
 
-    # Loop through each specified scan result directory
     for scan_dir in scan_directories:
         full_scan_path = os.path.join(base_path, scan_dir)
-        scan_results = {}
-        #print(f"Looking in base path: {base_path}")
-        if os.path.isdir(full_scan_path):
-            #print(f"Found directory: {full_scan_path}")
-            # Loop through all JSON files in the current scan directory
-            for filename in os.listdir(full_scan_path):
-                if filename.endswith(".json"):
-                    try:
-                        with open(
-                            os.path.join(full_scan_path, filename), "r"
-                        ) as json_file:
-                            # Use the filename (without '.json') as the key for these results
-                            result_key = filename[:-5]
-                            #print("Result key:", result_key)
-                            scan_results = json.load(json_file)
-                            # # Use the filename (without '.json') as the key for these results
-                            # result_key = filename[:-5]
-                            # print("Result key:", result_key)
-                            # scan_results[result_key] = json.load(json_file)
-                    except Exception as e:
-                        scan_results[result_key] = f"Failed to load results: {e}"
-        else:
-            print(f"Directory not found: {full_scan_path}")
+        signature = get_directory_signature(full_scan_path)
+        with _cache_lock:
+            cached = _results_cache.get(scan_dir)
+        if cached is not None and cached[0] == signature:
+            results[scan_dir] = cached[1]
+            continue
 
-        results[scan_dir] = scan_results
+        scan_results = load_directory(full_scan_path)
+        process = processors.get(scan_dir)
+        if process is not None:
+            scan_results = process(scan_results)
 
-    #print()
-    #print()
-    #print("Results:", json.dumps(results, indent=2))
-    #print()
-    #print()
+        with _cache_lock:
+            _results_cache[scan_dir] = (signature, scan_results)
+        results[scan_dir] = scan_results
 
     return results
+
+
+def merge_results(documents):
+    # Combine the JSON files of one directory instead of keeping only the last
+    if not documents:
+        return {}
+    if len(documents) == 1:
+        return documents[0]
+    if all(isinstance(d, list) for d in documents):
+        return [item for d in documents for item in d]
+    if all(isinstance(d, dict) and "host" in d for d in documents):
+        # One record per file (e.g. one nmap scan per target)
+        return documents
+    if all(isinstance(d, dict) for d in documents):
+        merged = {}
+        for d in documents:
+            for key, value in d.items():
+                if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                    merged[key] = {**merged[key], **value}
+                else:
+                    merged[key] = value
+        return merged
+    return documents[-1]
+
+
+def assemble_hosts(records):
+    hosts = {"online": {}, "offline": {}}
+    for record in records:
+        if "status_code" in record:
+            hosts["online"][record["host"]] = {
+                "status_code": record["status_code"],
+                "latency_ms": record.get("latency_ms"),
+            }
+        else:
+            hosts["offline"][record["host"]] = {"error": record.get("error")}
+    return hosts
+
+
+def assemble_directories(records):
+    directories = {}
+    for record in records:
+        host = record.pop("host", "")
+        directories.setdefault(host, []).append(record)
+    return directories
+
+
+# Rebuild the JSON document shape of a category from its NDJSON records;
+# every other category is a plain list of records
+ndjson_assemblers = {
+    "hosts": assemble_hosts,
+    "directories": assemble_directories,
+}
+
+
+def load_directory(full_scan_path):
+    assemble = ndjson_assemblers.get(os.path.basename(full_scan_path), list)
+    documents = []
+    #print(f"Looking in base path: {base_path}")
+    if os.path.isdir(full_scan_path):
+        #print(f"Found directory: {full_scan_path}")
+        # Loop through all JSON files in the current scan directory
+        for filename in sorted(os.listdir(full_scan_path)):
+            if filename.endswith(".json"):
+                try:
+                    with open(
+                        os.path.join(full_scan_path, filename), "r"
+                    ) as json_file:
+                        documents.append(json.load(json_file))
+                except Exception as e:
+                    print(f"Failed to load results from {filename}: {e}")
+            elif filename.endswith(".ndjson"):
+                # Stream the records instead of loading the whole file
+                documents.append(assemble(iter_ndjson(os.path.join(full_scan_path, filename))))
+    else:
+        print(f"Directory not found: {full_scan_path}")
+
+    return merge_results(documents)
+
+
+def read_stored_results(scan_directories, processors=None):
+    """
+    Same as read_all_json_results, but reads every category the scanners have
+    written to the results database from there, cached by its revision.
+    Categories with nothing stored yet fall back to their JSON files.
+    """
+    processors = processors or {}
+    revisions = storage.get_revisions()
+    results = {}
+    json_directories = []
+
+    for scan_dir in scan_directories:
+        revision = revisions.get(scan_dir)
+        if not revision:
+            json_directories.append(scan_dir)
+            continue
+
+        signature = ("db", storage.get_db_path(), revision)
+        with _cache_lock:
+            cached = _results_cache.get(scan_dir)
+        if cached is not None and cached[0] == signature:
+            results[scan_dir] = cached[1]
+            continue
+
+        scan_results = storage.read_category(scan_dir)
+        process = processors.get(scan_dir)
+        if process is not None:
+            scan_results = process(scan_results)
+
+        with _cache_lock:
+            _results_cache[scan_dir] = (signature, scan_results)
+        results[scan_dir] = scan_results
+
+    results.update(read_all_json_results(json_directories, processors))
+    return {scan_dir: results[scan_dir] for scan_dir in scan_directories}
@@ -0,0 +1,121 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def run_task(task_name, func, args, job=None):
+    # Record per-task state and duration on the job, if there is one
+    if job is not None:
+        job.task_started(task_name)
+    try:
+        func(*args)
+    except Exception as exc:
+        if job is not None:
+            job.task_finished(task_name, error=exc)
+        raise
+    if job is not None:
+        job.task_finished(task_name)
+
+
+def build_graph(tasks):
+    """
+    Maps every task name to the names of the tasks it has to wait for.
+    Inputs that no task in the run produces are assumed to already exist on
+    disk from a previous scan and do not block anything.
+    """
+    producers = {}
+    for task_name, func, _ in tasks:
+        for artifact in getattr(func, "provides", ()):
+            producers.setdefault(artifact, []).append(task_name)
+
+    graph = {}
+    for task_name, func, _ in tasks:
+        dependencies = set()
+        for artifact in getattr(func, "requires", ()):
+            dependencies.update(producers.get(artifact, []))
+        dependencies.discard(task_name)
+        graph[task_name] = dependencies
+    return graph
+
+
+def critical_path(graph, timings):
+    """
+    Walks back from the task that finished last, following at each step the
+    dependency that finished latest, i.e. the one that actually gated it.
+    """
+    finished = {name: t for name, t in timings.items() if t.get("finished_at")}
+    if not finished:
+        return {"tasks": [], "duration": 0.0}
+
+    path = []
+    current = max(finished, key=lambda name: finished[name]["finished_at"])
+    while current:
+        path.append(current)
+        dependencies = [dep for dep in graph.get(current, ()) if dep in finished]
+        current = max(dependencies, key=lambda dep: finished[dep]["finished_at"], default=None)
+    path.reverse()
+
+    start = min(t["started_at"] for t in finished.values())
+    end = finished[path[-1]]["finished_at"]
+    return {
+        "tasks": [
+            {"name": name, "duration": round(finished[name]["finished_at"] - finished[name]["started_at"], 3)}
+            for name in path
+        ],
+        "duration": round(end - start, 3),
+    }
+
+
+def run_task_graph(tasks, job=None, max_workers=None):
+    # Ensure 'tasks' is a list of tuples
+    if not isinstance(tasks, list):
+        raise TypeError("Expected a list of tasks")
+
+    graph = build_graph(tasks)
+    by_name = {task[0]: task for task in tasks}
+    pending = dict(graph)
+    completed = set()
+    timings = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures_to_task = {}
+
+        while pending or futures_to_task:
+            if job is not None and job.cancelled.is_set() and pending:
+                # Let the running tasks wind down, start nothing new
+                for task_name in pending:
+                    job.task_cancelled(task_name)
+                pending.clear()
+                if not futures_to_task:
+                    break
+
+            ready = [name for name, deps in pending.items() if deps <= completed]
+            for task_name in ready:
+                del pending[task_name]
+                _, func, args = by_name[task_name]
+                timings[task_name] = {"started_at": time.time(), "finished_at": None}
+                futures_to_task[executor.submit(run_task, task_name, func, args, job)] = task_name
+
+            if not futures_to_task:
+                raise RuntimeError(f"Unresolvable task dependencies: {sorted(pending)}")
+
+            done, _ = wait(futures_to_task, return_when=FIRST_COMPLETED)
+            for future in done:
+                task_name = futures_to_task.pop(future)
+                timings[task_name]["finished_at"] = time.time()
+                try:
+                    # Process each task and handle exceptions
+                    future.result()
+                except Exception as exc:
+                    print(f"Task '{task_name}' generated an exception: {exc}")
+                # Dependents still run on whatever the failed task left on disk,
+                # just like the next phase used to
+                completed.add(task_name)
+
+    report = critical_path(graph, timings)
+    print(
+        f"Critical path ({report['duration']}s): "
+        + " -> ".join(f"{t['name']} ({t['duration']}s)" for t in report["tasks"])
+    )
+    if job is not None:
+        job.critical_path = report
+    return report